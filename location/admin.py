@@ -1,16 +1,20 @@
 import logging
 
 from django.conf.urls import patterns, url
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.gis import admin
 from django.contrib.messages.api import get_messages
 from django.contrib.sites.models import Site
 from django.template.response import TemplateResponse
 
 from location.models import (
+    CurrentLocation,
     LocationConsumerSettings,
     LocationSnapshot,
     LocationSource,
-    LocationSourceType
+    LocationSourceType,
+    PendingCheckin,
+    SignalOutboxEntry
 )
 
 logger = logging.getLogger('location.admin')
@@ -56,6 +60,12 @@ class LocationSourceAdmin(admin.options.OSMGeoAdmin):
         )
 
 
+class LocationSnapshotChangeList(ChangeList):
+    def get_results(self, request):
+        super(LocationSnapshotChangeList, self).get_results(request)
+        LocationSnapshot.load_location_details(self.result_list)
+
+
 class LocationSnapshotAdmin(admin.options.OSMGeoAdmin):
     list_display = (
         'date',
@@ -71,9 +81,12 @@ class LocationSnapshotAdmin(admin.options.OSMGeoAdmin):
     ]
     search_fields = [
         'source__type',
-        'source__user__username',
+        'user__username',
     ]
 
+    def get_changelist(self, request, **kwargs):
+        return LocationSnapshotChangeList
+
     def nearest_city(self, obj):
         city = obj.city
         if city:
@@ -91,7 +104,41 @@ class LocationConsumerSettingsAdmin(admin.options.OSMGeoAdmin):
     raw_id_fields = ('user', )
 
 
+class CurrentLocationAdmin(admin.options.OSMGeoAdmin):
+    list_display = (
+        'user',
+        'date',
+    )
+    raw_id_fields = ('user', 'snapshot', )
+
+
+class SignalOutboxEntryAdmin(admin.options.OSMGeoAdmin):
+    list_display = (
+        'created',
+        'signal',
+        'user',
+        'attempts',
+        'next_attempt',
+    )
+    list_filter = [
+        'signal'
+    ]
+    ordering = ['-created']
+    raw_id_fields = ('user', )
+
+
+class PendingCheckinAdmin(admin.options.OSMGeoAdmin):
+    list_display = (
+        'received',
+        'attempts',
+    )
+    ordering = ['-received']
+
+
 admin.site.register(LocationSourceType)
 admin.site.register(LocationSource, LocationSourceAdmin)
 admin.site.register(LocationSnapshot, LocationSnapshotAdmin)
 admin.site.register(LocationConsumerSettings, LocationConsumerSettingsAdmin)
+admin.site.register(CurrentLocation, CurrentLocationAdmin)
+admin.site.register(SignalOutboxEntry, SignalOutboxEntryAdmin)
+admin.site.register(PendingCheckin, PendingCheckinAdmin)
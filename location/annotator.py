@@ -0,0 +1,75 @@
+import datetime
+import logging
+
+from django.utils.timezone import utc
+
+from location import models
+from location.settings import SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocationAnnotator(object):
+    """ Stores the city and neighborhood of each snapshot.
+
+    Can be added to ``periodic_consumers`` to annotate new snapshots as
+    they arrive.
+
+    """
+    @classmethod
+    def periodic(cls):
+        cls.annotate()
+
+    @classmethod
+    def annotate(cls, batch_size=None, limit=None):
+        if not models.PlaceBoundary and not models.Neighborhood:
+            logger.warning(
+                'Neither django-census-places nor django-neighborhoods '
+                'is installed; no locations will be annotated.'
+            )
+            return 0
+
+        batch_size = batch_size or SETTINGS['annotator']['batch_size']
+        annotated = 0
+        while limit is None or annotated < limit:
+            if limit is not None:
+                batch_size = min(batch_size, limit - annotated)
+            snapshots = list(
+                models.LocationSnapshot.objects.filter(
+                    geocoded=None,
+                ).order_by('pk')[:batch_size]
+            )
+            if not snapshots:
+                break
+            cls.annotate_batch(snapshots)
+            annotated += len(snapshots)
+            logger.info('Annotated %s snapshot(s).', annotated)
+        return annotated
+
+    @classmethod
+    def annotate_batch(cls, snapshots):
+        models.LocationSnapshot.load_location_details(snapshots)
+
+        # Snapshots sharing a city and neighborhood are updated together.
+        groups = {}
+        for snapshot in snapshots:
+            key = (
+                cls.get_id(snapshot.city),
+                cls.get_id(snapshot.neighborhood),
+            )
+            groups.setdefault(key, []).append(snapshot.pk)
+
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        for (city_id, neighborhood_id), pks in groups.items():
+            models.LocationSnapshot.objects.filter(
+                pk__in=pks
+            ).update(
+                city_id=city_id,
+                neighborhood_id=neighborhood_id,
+                geocoded=now,
+            )
+
+    @classmethod
+    def get_id(cls, instance):
+        return instance.pk if instance is not None else None
@@ -0,0 +1,115 @@
+import copy
+import logging
+import threading
+
+from django.contrib.gis.measure import D
+
+from location.utils import get_distance_meters
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    from shapely import wkb
+    from shapely.geometry import Point as ShapelyPoint
+    from shapely.ops import nearest_points
+    from shapely.prepared import prep
+    from shapely.strtree import STRtree
+except ImportError:
+    STRtree = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class LonLat(object):
+    # Provides the ``coords`` expected by ``get_distance_meters``.
+    def __init__(self, x, y):
+        self.coords = (x, y, )
+
+
+class BoundaryIndex(object):
+    """ An in-memory spatial index of every boundary of a model.
+
+    Answers the same questions as ``get_containing`` and
+    ``get_nearest_to`` of django-census-places' ``PlaceBoundary`` and
+    django-neighborhoods' ``Neighborhood``, without querying the
+    database.
+
+    """
+    def __init__(self, model, field_name):
+        self.model = model
+        self.boundaries = []
+        self.geometries = []
+        self.prepared = []
+        for boundary in model.objects.all().iterator():
+            geometry = getattr(boundary, field_name)
+            if geometry is None:
+                continue
+            self.boundaries.append(boundary)
+            self.geometries.append(wkb.loads(bytes(geometry.wkb)))
+        self.prepared = [prep(geometry) for geometry in self.geometries]
+        # Shapely 1.x returns the indexed geometries themselves, rather
+        # than their positions.
+        self.positions = dict(
+            (id(geometry), position)
+            for position, geometry in enumerate(self.geometries)
+        )
+        self.tree = STRtree(self.geometries) if self.geometries else None
+        logger.info(
+            'Indexed %s %s boundaries.',
+            len(self.boundaries),
+            model.__name__,
+        )
+
+    def _get_position(self, result):
+        if result is None:
+            return None
+        if hasattr(result, 'geom_type'):
+            return self.positions[id(result)]
+        return int(result)
+
+    def get_containing(self, point):
+        if self.tree is not None:
+            shapely_point = ShapelyPoint(point.x, point.y)
+            for result in self.tree.query(shapely_point):
+                position = self._get_position(result)
+                if self.prepared[position].contains(shapely_point):
+                    return self.boundaries[position]
+        raise self.model.DoesNotExist()
+
+    def get_nearest_to(self, point):
+        if self.tree is None:
+            raise self.model.DoesNotExist()
+        shapely_point = ShapelyPoint(point.x, point.y)
+        position = self._get_position(self.tree.nearest(shapely_point))
+        # The distance differs for each point, so isn't set on the boundary
+        # shared with other callers.
+        boundary = copy.copy(self.boundaries[position])
+        nearest = nearest_points(self.geometries[position], shapely_point)[0]
+        boundary.distance = D(
+            m=get_distance_meters(point, LonLat(nearest.x, nearest.y))
+        )
+        return boundary
+
+
+def get_boundary_index(model, field_name):
+    """ Returns the index of ``model``'s boundaries, building it when first
+    requested by this process.
+
+    Returns ``None`` if Shapely isn't installed.
+
+    """
+    if STRtree is None:
+        return None
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = BoundaryIndex(model, field_name)
+        return _indexes[model]
+
+
+def clear_boundary_indexes():
+    with _indexes_lock:
+        _indexes.clear()
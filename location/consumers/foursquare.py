@@ -1,34 +1,202 @@
 import datetime
+import functools
 import json
+import logging
 
 from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 import pytz
 from social_auth.models import UserSocialAuth
 
 from location.models import (
     LocationSnapshot,
     LocationSource,
-    LocationSourceType
+    LocationSourceType,
+    PendingCheckin
 )
+from location.settings import SETTINGS
 from location.signals import watch_location
+from location.utils import BoundedCache, on_commit, transaction_scope
+
+
+logger = logging.getLogger(__name__)
+
+
+# Most pushes come from a few users, whose Django user ids are kept in
+# each process as well as in the shared cache.
+_user_ids = BoundedCache(
+    SETTINGS['foursquare']['user_cache_size'],
+    ttl=SETTINGS['foursquare']['user_ttl_seconds'],
+)
+
+
+def get_user_cache_key(uid):
+    return '%s:FoursquareUser:%s' % (
+        SETTINGS['cache_prefix'],
+        uid,
+    )
+
+
+@receiver(post_save, sender=UserSocialAuth, dispatch_uid='forget_4sq_user')
+@receiver(post_delete, sender=UserSocialAuth, dispatch_uid='forget_4sq_user')
+def forget_user(sender, instance, **kwargs):
+    # Other processes forget the user once ``user_ttl_seconds`` pass.
+    if instance.provider == 'foursquare':
+        _user_ids.pop(instance.uid)
+        cache.delete(get_user_cache_key(instance.uid))
 
 
 class FoursquareConsumer(object):
     def __init__(self, data):
         self.data = json.loads(data)
 
+    @classmethod
+    def enqueue(cls, data):
+        """ Stores a pushed check-in to be processed by ``periodic``.
+
+        Raises ``ValueError`` if ``data`` isn't a JSON object.
+
+        """
+        checkin = json.loads(data)
+        if not isinstance(checkin, dict):
+            raise ValueError('Check-in is not a JSON object.')
+
+        checkin_id = checkin.get('id')
+        if checkin_id is None:
+            return PendingCheckin.objects.create(data=data)
+        if cls.has_seen(checkin_id):
+            logger.info('Check-in %s was already received.', checkin_id)
+            return None
+        pending, created = PendingCheckin.objects.get_or_create(
+            checkin_id=checkin_id,
+            defaults={
+                'data': data,
+            }
+        )
+        return pending if created else None
+
+    @classmethod
+    def get_seen_cache_key(cls, checkin_id):
+        return '%s:FoursquareCheckin:%s' % (
+            SETTINGS['cache_prefix'],
+            checkin_id,
+        )
+
+    @classmethod
+    def has_seen(cls, checkin_id):
+        """ Returns ``True`` if the check-in is known to have been stored.
+        """
+        if checkin_id is None:
+            return False
+        return cache.get(cls.get_seen_cache_key(checkin_id)) is not None
+
+    @classmethod
+    def mark_seen(cls, checkin_id):
+        """ Records that the check-in has been stored once the check-in's
+        writes have been committed, as they may still be rolled back.
+
+        """
+        if checkin_id is not None:
+            on_commit(functools.partial(
+                cache.add,
+                cls.get_seen_cache_key(checkin_id),
+                True,
+                SETTINGS['foursquare']['seen_ttl_seconds'],
+            ))
+
+    @classmethod
+    def periodic(cls):
+        cls.process_pending_checkins()
+
+    @classmethod
+    def process_pending_checkins(cls):
+        config = SETTINGS['foursquare']
+        last_pk = 0
+        while True:
+            pending = list(
+                PendingCheckin.objects.filter(
+                    pk__gt=last_pk,
+                    attempts__lt=config['max_attempts'],
+                ).order_by('pk')[:config['batch_size']]
+            )
+            if not pending:
+                break
+            # Read before processing, which clears the primary keys of the
+            # check-ins it deletes.
+            last_pk = pending[-1].pk
+            for checkin in pending:
+                cls.process_pending_checkin(checkin)
+
+    @classmethod
+    def process_pending_checkin(cls, checkin):
+        # Claimed by incrementing its attempts so that concurrent workers
+        # don't also process it.
+        claimed = PendingCheckin.objects.filter(
+            pk=checkin.pk,
+            attempts=checkin.attempts,
+        ).update(
+            attempts=checkin.attempts + 1
+        )
+        if not claimed:
+            return
+        try:
+            with transaction_scope('source', 'batch'):
+                cls(checkin.data).process_checkin()
+                checkin.delete()
+        except Exception as e:
+            logger.exception('Unable to process check-in %s.', checkin.pk)
+            PendingCheckin.objects.filter(
+                pk=checkin.pk
+            ).update(
+                last_error=repr(e)
+            )
+            return
+        cls.mark_seen(checkin.checkin_id)
+
+    def process(self):
+        """ Stores the check-in, unless it's known to have been stored.
+        """
+        checkin_id = self.data.get('id')
+        if self.has_seen(checkin_id):
+            logger.info('Check-in %s was already stored.', checkin_id)
+            return None
+        snapshot = self.process_checkin()
+        self.mark_seen(checkin_id)
+        return snapshot
+
     def process_checkin(self):
         if self.data['type'] == 'checkin':
-            user = self.get_user()
-            source = LocationSource.objects.create(
-                name=self.data['venue']['name'],
-                user=user,
-                type=self.get_source_type(),
-                data=self.data
-            )
+            # Foursquare delivers check-ins again if it doesn't receive a
+            # response quickly enough.
+            checkin_id = self.data.get('id')
+            user_id = self.get_user_id()
+            source_type = self.get_source_type()
+            source_fields = {
+                'name': self.data['venue']['name'],
+                'user_id': user_id,
+                'data': self.data,
+            }
+            if checkin_id is None:
+                source = LocationSource.objects.create(
+                    type=source_type,
+                    **source_fields
+                )
+            else:
+                source, created = LocationSource.objects.get_or_create(
+                    type=source_type,
+                    external_id=checkin_id,
+                    defaults=source_fields,
+                )
+                if not created and source.points.exists():
+                    logger.info(
+                        'Check-in %s was already stored.', checkin_id
+                    )
+                    return None
 
-            with watch_location(user):
-                return LocationSnapshot.objects.create(
+            with watch_location(user_id):
+                snapshot = LocationSnapshot.objects.create(
                     location=Point(
                         self.data['venue']['location']['lng'],
                         self.data['venue']['location']['lat'],
@@ -40,18 +208,38 @@ class FoursquareConsumer(object):
                         )
                     ),
                     source=source,
+                    user_id=user_id,
                 )
+            return snapshot
         return None
 
-    def get_user(self):
-        return UserSocialAuth.objects.get(
-            uid=self.data['user']['id'],
-            provider='foursquare',
-        ).user
+    def get_user_id(self):
+        """ Returns the id of the Django user having made this check-in.
+
+        Raises ``UserSocialAuth.DoesNotExist`` if the Foursquare user
+        isn't associated with a Django user.
+
+        """
+        uid = '%s' % self.data['user']['id']
+        user_id = _user_ids.get(uid)
+        if user_id is not None:
+            return user_id
+
+        cache_key = get_user_cache_key(uid)
+        user_id = cache.get(cache_key)
+        if user_id is None:
+            user_id = UserSocialAuth.objects.filter(
+                uid=uid,
+                provider='foursquare',
+            ).values_list('user_id', flat=True).get()
+            cache.set(
+                cache_key,
+                user_id,
+                SETTINGS['foursquare']['user_ttl_seconds'],
+            )
+        _user_ids.set(uid, user_id)
+        return user_id
 
     @classmethod
     def get_source_type(cls):
-        source_type, _ = LocationSourceType.objects.get_or_create(
-            name='Foursquare Check-in'
-        )
-        return source_type
+        return LocationSourceType.objects.get_for_name('Foursquare Check-in')
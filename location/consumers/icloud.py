@@ -1,8 +1,12 @@
 import datetime
 import logging
+import sys
+import threading
 import time
 
 from django.contrib.gis.geos import Point
+from django.db.models import Q
+from django.utils.timezone import utc
 import pyicloud
 import pytz
 
@@ -14,6 +18,12 @@ from location.models import (
 )
 from location.settings import SETTINGS
 from location.signals import watch_location
+from location.utils import (
+    BoundedCache,
+    get_distance_meters,
+    threaded_map,
+    transaction_scope
+)
 
 
 logger = logging.getLogger(__name__)
@@ -27,56 +37,113 @@ class UnknownDeviceException(Exception):
     pass
 
 
+_sessions = BoundedCache(
+    SETTINGS['icloud']['session_cache_size'],
+    ttl=SETTINGS['icloud']['session_ttl_seconds'],
+)
+_login_locks = {}
+
+
+def get_icloud_session(username, password):
+    """ Returns a logged-in iCloud session for ``username``.
+
+    Sessions are shared by every consumer using the same account, and
+    concurrent requests for the same account wait for a single login.
+
+    """
+    with _login_locks.setdefault(username, threading.Lock()):
+        cached = _sessions.get(username)
+        if cached is not None and cached[0] == password:
+            return cached[1]
+
+        logger.debug('Logging in to iCloud account %s.', username)
+        api = pyicloud.PyiCloudService(username, password)
+        _sessions.set(username, (password, api, ))
+        return api
+
+
+def forget_icloud_session(username):
+    _sessions.pop(username)
+
+
 class iCloudConsumer(object):
     def __init__(self, user_settings):
         self.user_settings = user_settings
 
     @classmethod
     def periodic(cls):
-        users = cls.get_icloud_enabled_settings()
-        for user_settings in users:
-            instance = cls(user_settings)
-            try:
-                instance.update_location()
-            except pyicloud.exceptions.PyiCloudFailedLoginException:
-                logger.exception(
-                    'Unable to log-in to iCloud with the provided credentials '
-                    '; disabling icloud for %s',
-                    user_settings,
-                )
-                cls.disable_icloud(
-                    user_settings,
-                    "Unable to login to iCloud account '%s' using provided "
-                    "credentials." % (
-                        user_settings.icloud_device_id,
-                        user_settings.icloud_username,
-                    )
-                )
-            except UnknownDeviceException:
-                logger.exception(
-                    'Unable to find device on the account using the provided '
-                    'credentials',
-                    user_settings,
-                )
-                cls.disable_icloud(
-                    user_settings,
-                    "Unable to find device '%s' on iCloud account '%s'." % (
-                        user_settings.icloud_device_id,
-                        user_settings.icloud_username,
-                    )
-                )
-            except LocationUnavailableException as e:
-                logger.warning(
-                    'Location currently unavailable for consumer settings %s',
-                    instance,
+        deadline = time.time() + SETTINGS['icloud']['deadline_seconds']
+        instances = [
+            cls(user_settings)
+            for user_settings in cls.get_icloud_enabled_settings()
+        ]
+
+        # Waiting for an accurate location happens concurrently, but
+        # locations are stored one at a time from this thread.
+        gathered = threaded_map(
+            lambda instance: instance.get_location_data(deadline=deadline),
+            instances,
+            SETTINGS['icloud']['workers'],
+            deadline=deadline,
+        )
+        for instance, data, exc_info in gathered:
+            if exc_info is None:
+                try:
+                    with transaction_scope('source', 'batch'):
+                        instance.update_location(data)
+                    continue
+                except Exception:
+                    exc_info = sys.exc_info()
+            cls.handle_error(instance, exc_info)
+
+    @classmethod
+    def handle_error(cls, instance, exc_info):
+        user_settings = instance.user_settings
+        exception = exc_info[1]
+        if isinstance(
+            exception, pyicloud.exceptions.PyiCloudFailedLoginException
+        ):
+            logger.error(
+                'Unable to log-in to iCloud with the provided credentials '
+                '; disabling icloud for %s',
+                user_settings,
+                exc_info=exc_info,
+            )
+            cls.disable_icloud(
+                user_settings,
+                "Unable to login to iCloud account '%s' using provided "
+                "credentials." % (
+                    user_settings.icloud_username,
                 )
-            except Exception as e:
-                logger.exception(
-                    'Unable to gather iCloud location for location consumer'
-                    'settings %s: %s',
-                    instance,
-                    e
+            )
+        elif isinstance(exception, UnknownDeviceException):
+            logger.error(
+                'Unable to find device on the account using the provided '
+                'credentials; disabling icloud for %s',
+                user_settings,
+                exc_info=exc_info,
+            )
+            cls.disable_icloud(
+                user_settings,
+                "Unable to find device '%s' on iCloud account '%s'." % (
+                    user_settings.icloud_device_id,
+                    user_settings.icloud_username,
                 )
+            )
+        elif isinstance(exception, LocationUnavailableException):
+            logger.warning(
+                'Location currently unavailable for consumer settings %s',
+                user_settings,
+            )
+            instance.schedule_next_poll()
+        else:
+            logger.error(
+                'Unable to gather iCloud location for location consumer '
+                'settings %s: %s',
+                user_settings,
+                exception,
+                exc_info=exc_info,
+            )
 
     @classmethod
     def disable_icloud(cls, user_settings, message=None):
@@ -90,18 +157,38 @@ class iCloudConsumer(object):
 
     @classmethod
     def get_icloud_enabled_settings(cls):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
         return LocationConsumerSettings.objects.filter(
-            icloud_enabled=True
+            Q(icloud_next_poll__isnull=True) | Q(icloud_next_poll__lte=now),
+            icloud_enabled=True,
         )
 
-    def get_location_data(self):
-        api = pyicloud.PyiCloudService(
+    def get_location_data(self, deadline=None):
+        stop = time.time() + SETTINGS['icloud']['max_wait_seconds']
+        if deadline is not None:
+            if time.time() > deadline:
+                raise LocationUnavailableException(
+                    'Deadline reached before polling device %s' % (
+                        self.user_settings.icloud_device_id,
+                    )
+                )
+            stop = min(stop, deadline)
+
+        api = get_icloud_session(
             self.user_settings.icloud_username,
             self.user_settings.icloud_password,
         )
+        try:
+            return self._wait_for_location_data(api, stop)
+        except (LocationUnavailableException, UnknownDeviceException):
+            raise
+        except Exception:
+            # The session may have expired; log in again next time.
+            forget_icloud_session(self.user_settings.icloud_username)
+            raise
 
-        started = time.time()
-        while time.time() - started < SETTINGS['icloud']['max_wait_seconds']:
+    def _wait_for_location_data(self, api, stop):
+        while time.time() < stop:
             try:
                 device = api.devices[self.user_settings.icloud_device_id]
             except KeyError:
@@ -120,7 +207,15 @@ class iCloudConsumer(object):
             )
             if self.data_is_accurate(data):
                 return data
-            time.sleep(SETTINGS['icloud']['request_interval_seconds'])
+            time.sleep(
+                max(
+                    min(
+                        SETTINGS['icloud']['request_interval_seconds'],
+                        stop - time.time(),
+                    ),
+                    0
+                )
+            )
 
         raise LocationUnavailableException(
             'Unable to acquire location of device %s within %s seconds',
@@ -154,9 +249,10 @@ class iCloudConsumer(object):
             return False
         return True
 
-    def update_location(self):
+    def update_location(self, data=None):
         source_type = self.get_source_type()
-        data = self.get_location_data()
+        if data is None:
+            data = self.get_location_data()
 
         local_tz = pytz.timezone(self.user_settings.icloud_timezone)
 
@@ -165,37 +261,100 @@ class iCloudConsumer(object):
             local_tz
         )
 
-        if LocationSnapshot.objects.filter(
-            date__gt=date - datetime.timedelta(minutes=1),
-            source__type=source_type,
-            source__user=self.user_settings.user,
-        ).exists():
+        previous = self.get_previous_snapshot(source_type)
+        if (
+            previous is not None
+            and previous.date > date - datetime.timedelta(minutes=1)
+        ):
             logger.info(
                 'Found another sample from within the last minute; skipping '
                 'gathered icloud location'
             )
+            self.schedule_next_poll(previous, previous)
             return
 
-        with watch_location(self.user_settings.user):
+        with watch_location(self.user_settings.user_id):
             source = LocationSource.objects.create(
                 name='Apple iCloud location at %s' % date,
                 type=source_type,
-                user=self.user_settings.user,
+                user_id=self.user_settings.user_id,
                 data=data,
                 active=False,
             )
-            return LocationSnapshot.objects.create(
+            snapshot = LocationSnapshot.objects.create(
                 source=source,
+                user_id=self.user_settings.user_id,
                 location=Point(
                     data['longitude'],
                     data['latitude'],
                 ),
                 date=date,
             )
+        self.schedule_next_poll(previous, snapshot)
+        return snapshot
+
+    def get_previous_snapshot(self, source_type):
+        try:
+            return LocationSnapshot.objects.filter(
+                user=self.user_settings.user_id,
+                source__type=source_type,
+            ).order_by('-date')[0]
+        except IndexError:
+            return None
+
+    def get_poll_interval(self, previous=None, current=None):
+        """ Returns the number of seconds to wait before polling again.
+
+        Polling backs off while the device stays in place, and speeds up
+        while it is moving.
+
+        """
+        config = SETTINGS['icloud']
+        interval = (
+            self.user_settings.icloud_poll_interval
+            or config['poll_interval_seconds']
+        )
+        if previous is None or current is None:
+            return interval
+
+        distance = get_distance_meters(previous.location, current.location)
+        elapsed = current.date - previous.date
+        elapsed_seconds = elapsed.days * 86400 + elapsed.seconds
+        speed = distance / elapsed_seconds if elapsed_seconds > 0 else 0
+
+        if distance < config['stationary_distance_meters']:
+            interval = interval * 2
+        elif speed >= config['moving_speed_meters_per_second']:
+            interval = config['min_poll_interval_seconds']
+        else:
+            interval = max(interval / 2, config['poll_interval_seconds'])
+        return int(
+            max(
+                min(interval, config['max_poll_interval_seconds']),
+                config['min_poll_interval_seconds'],
+            )
+        )
+
+    def schedule_next_poll(self, previous=None, current=None):
+        interval = self.get_poll_interval(previous, current)
+        next_poll = (
+            datetime.datetime.utcnow().replace(tzinfo=utc)
+            + datetime.timedelta(seconds=interval)
+        )
+        logger.debug(
+            'Next iCloud poll for %s in %s seconds.',
+            self.user_settings,
+            interval,
+        )
+        self.user_settings.icloud_poll_interval = interval
+        self.user_settings.icloud_next_poll = next_poll
+        LocationConsumerSettings.objects.filter(
+            pk=self.user_settings.pk
+        ).update(
+            icloud_poll_interval=interval,
+            icloud_next_poll=next_poll,
+        )
 
     @classmethod
     def get_source_type(cls):
-        source_type, _ = LocationSourceType.objects.get_or_create(
-            name='Apple iCloud'
-        )
-        return source_type
+        return LocationSourceType.objects.get_for_name('Apple iCloud')
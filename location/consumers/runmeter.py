@@ -1,43 +1,81 @@
 import datetime
 import logging
 import re
+import threading
 
 from django.contrib.gis.geos import Point
 from django.utils.timezone import utc
 from django.db.models import Max
-from lxml import objectify
+from lxml import etree
 import requests
 from requests.adapters import HTTPAdapter
 
 from location.models import (
+    CurrentLocation,
     LocationConsumerSettings,
     LocationSnapshot,
     LocationSource,
     LocationSourceType
 )
-from location.signals import watch_location
+from location.settings import SETTINGS
+from location.signals import register_snapshots, watch_location
+from location.utils import threaded_map, transaction_scope
 
 
 logger = logging.getLogger(__name__)
 
 
+ABVIO_NAMESPACE = 'http://www.abvio.com/xmlschemas/1'
+
+DOCUMENT_FIELDS = dict(
+    ('{%s}%s' % (ABVIO_NAMESPACE, name), name) for name in [
+        'activityName',
+        'coordinateTable',
+        'routeName',
+        'startTime',
+    ]
+)
+
+COORDINATE_ROW = re.compile(r'[^\n]+')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """ Returns the session shared by all Runmeter consumers.
+
+    The session's connection pool holds one connection per worker so that
+    keep-alive connections to the Runmeter host are reused between
+    fetches and between runs.
+
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            for prefix in ('http://', 'https://'):
+                session.mount(
+                    prefix,
+                    HTTPAdapter(
+                        max_retries=5,
+                        pool_maxsize=max(SETTINGS['runmeter']['workers'], 1),
+                    ),
+                )
+            _session = session
+    return _session
+
+
 class RunmeterConsumer(object):
     NAMESPACES = {
         'kml': 'http://www.opengis.net/kml/2.2',
-        'abvio': 'http://www.abvio.com/xmlschemas/1'
+        'abvio': ABVIO_NAMESPACE,
     }
 
     def __init__(self, source):
         self.source = source
-        self.session = requests.Session()
-        self.session.mount(
-            'http://',
-            HTTPAdapter(max_retries=5),
-        )
-        self.session.mount(
-            'https://',
-            HTTPAdapter(max_retries=5),
-        )
+        self.session = get_session()
+        self.validators = {}
 
     @classmethod
     def periodic(cls):
@@ -57,7 +95,8 @@ class RunmeterConsumer(object):
             source.active = False
 
         instance = RunmeterConsumer(source)
-        instance.process()
+        with transaction_scope('source'):
+            instance.process()
 
         message.read = datetime.datetime.utcnow().replace(tzinfo=utc)
         message.save()
@@ -71,26 +110,72 @@ class RunmeterConsumer(object):
             type=source_type,
             active=True,
         )
+        instances = []
         for source in sources:
             logger.debug(
                 'Found active source %s.', source
             )
-            instance = RunmeterConsumer(source)
-            instance.process()
+            instances.append(RunmeterConsumer(source))
+
+        # Documents are fetched and parsed concurrently, but stored one
+        # at a time from this thread.
+        fetched = threaded_map(
+            lambda instance: instance.fetch(),
+            instances,
+            SETTINGS['runmeter']['workers'],
+        )
+        for instance, document, exc_info in fetched:
+            if exc_info is not None:
+                logger.error(
+                    'Unable to fetch source %s.',
+                    instance.source,
+                    exc_info=exc_info,
+                )
+                continue
+            try:
+                with transaction_scope('source'):
+                    instance.update(document)
+            except Exception:
+                logger.exception(
+                    'Unable to process source %s.',
+                    instance.source,
+                )
+
+    def fetch(self):
+        return self._get_document(self.source.data['url'])
 
     def process(self):
+        self.update(self.fetch())
+
+    def update(self, document):
         logger.info('Processing source %s.', self.source)
-        document = self._get_document(self.source.data['url'])
+        if document is not None:
+            self._process_document(document)
+            self.source.data.update(self.validators)
+        else:
+            logger.debug('Source is unchanged since it was last fetched.')
+
+        if self.source.active:
+            self.source.active = self.is_active()
+            if not self.source.active:
+                logger.debug('Source has expired; marked inactive.')
+        self.source.save()
 
+    def _process_document(self, document):
         base_time = self.get_start_time(document)
         route_name = self.get_route_name(document)
 
-        with watch_location(self.source.user):
-            for raw_point in self.get_points(document, base_time):
-                key_name = raw_point['key']
-                if isinstance(self.source.data['known_points'], list):
-                    self.source.data['known_points'] = {}
-                if key_name not in self.source.data['known_points']:
+        last_point_time = self.source.data.get('last_point_time')
+
+        with watch_location(self.source.user_id):
+            pending = []
+            for raw_point in self.get_points(
+                document, base_time, since=last_point_time
+            ):
+                if (
+                    last_point_time is None
+                    or raw_point['time'] > last_point_time
+                ):
                     point = self._get_processed_point(raw_point, base_time)
                     logger.debug(
                         'Creating point %s,%s at %s.',
@@ -98,50 +183,69 @@ class RunmeterConsumer(object):
                         point['lng'],
                         point['date'],
                     )
-                    LocationSnapshot.objects.create(
-                        source=self.source,
-                        location=point['point'],
-                        date=point['date'],
-                    )
-                    self.source.data['known_points'][key_name] = raw_point
+                    pending.append((
+                        raw_point['time'],
+                        LocationSnapshot(
+                            source=self.source,
+                            user_id=self.source.user_id,
+                            location=point['point'],
+                            date=point['date'],
+                        ),
+                    ))
+                    last_point_time = raw_point['time']
                 else:
                     logger.debug(
                         'Point %s,%s already stored.',
                         raw_point['lat'],
                         raw_point['lng'],
                     )
+            self._store_snapshots(pending)
 
         if route_name:
             self.source.name = '%s (%s)' % (
                 route_name if route_name else 'AdHoc',
                 self.source.data['url']
             )
-        if self.source.active:
-            self.source.active = self.is_active()
-            if not self.source.active:
-                logger.debug('Source has expired; marked inactive.')
-        self.source.save()
+
+    def _store_snapshots(self, pending):
+        """ Stores ``(point_time, snapshot)`` pairs in batches.
+
+        The source's progress is saved along with each batch so that it
+        stays consistent with the stored points whatever the configured
+        transaction scope.
+
+        """
+        batch_size = SETTINGS['runmeter']['batch_size']
+        for offset in range(0, len(pending), batch_size):
+            batch = pending[offset:offset + batch_size]
+            logger.debug('Storing batch of %s points.', len(batch))
+            with transaction_scope('batch'):
+                LocationSnapshot.objects.bulk_create(
+                    [snapshot for _, snapshot in batch]
+                )
+                # Bulk creation neither sends post_save signals nor sets
+                # primary keys, so read the stored batch back; only points
+                # newer than any already stored are in the batch, so their
+                # dates identify them.
+                stored = list(
+                    self.source.points.filter(
+                        date__in=[snapshot.date for _, snapshot in batch],
+                    ).order_by('date')
+                )
+                register_snapshots(stored)
+                CurrentLocation.update_for_snapshot(stored[-1])
+                self.source.data['last_point_time'] = batch[-1][0]
+                self.source.save()
 
     def get_route_name(self, document):
-        values = document.xpath(
-            '//abvio:routeName',
-            namespaces=self.NAMESPACES
-        )
-        if values:
-            return values[0].text
-        values = document.xpath(
-            '//abvio:activityName',
-            namespaces=self.NAMESPACES
-        )
-        if values:
-            return values[0].text
+        if 'routeName' in document:
+            return document['routeName']
+        if 'activityName' in document:
+            return document['activityName']
         return None
 
     def get_start_time(self, document):
-        start_string = document.xpath(
-            '//abvio:startTime',
-            namespaces=self.NAMESPACES
-        )[0].text
+        start_string = document['startTime']
 
         return datetime.datetime.strptime(
             start_string[0:19],
@@ -150,22 +254,38 @@ class RunmeterConsumer(object):
             tzinfo=utc
         )
 
-    def get_points(self, document, base_time):
-        points = []
-        coordinate_table = document.xpath(
-            '//abvio:coordinateTable',
-            namespaces=self.NAMESPACES
-        )[0].text.split('\n')
-        for coordinate_row in coordinate_table:
-            if coordinate_row:
-                cols = coordinate_row.split(',')
-                points.append({
-                    'key': coordinate_row,
-                    'time': float(cols[0]),
-                    'lng': float(cols[1]),
-                    'lat': float(cols[2]),
-                })
-        return points
+    def get_points(self, document, base_time, since=None):
+        """ Lazily yields the rows of the document's coordinate table.
+
+        When ``since`` is set, rows having an elapsed time offset at or
+        before it are skipped without being parsed.
+
+        """
+        coordinate_table = document.get('coordinateTable') or ''
+        start = 0
+        if since is not None:
+            start = self._get_first_row_after(coordinate_table, since)
+        for match in COORDINATE_ROW.finditer(coordinate_table, start):
+            coordinate_row = match.group(0)
+            cols = coordinate_row.split(',')
+            yield {
+                'key': coordinate_row,
+                'time': float(cols[0]),
+                'lng': float(cols[1]),
+                'lat': float(cols[2]),
+            }
+
+    def _get_first_row_after(self, coordinate_table, since):
+        # Rows are ordered by their elapsed time offset, so walk backwards
+        # from the end of the table until reaching a row we already have.
+        end = len(coordinate_table)
+        while end > 0:
+            start = coordinate_table.rfind('\n', 0, end) + 1
+            coordinate_row = coordinate_table[start:end]
+            if coordinate_row and float(coordinate_row.split(',')[0]) <= since:
+                return end
+            end = start - 1
+        return 0
 
     def _get_processed_point(self, point, base_time):
         point = point.copy()
@@ -179,16 +299,62 @@ class RunmeterConsumer(object):
         return point
 
     def _get_document(self, url):
-        return objectify.fromstring(
-            self.session.get(url, timeout=10.0).content
+        """ Fetches and parses the document at ``url``.
+
+        Returns ``None`` if the document is unchanged since the source
+        last fetched it.
+
+        """
+        data = self.source.data
+        headers = {
+            'Accept-Encoding': 'gzip',
+        }
+        if data.get('etag'):
+            headers['If-None-Match'] = data['etag']
+        if data.get('last_modified'):
+            headers['If-Modified-Since'] = data['last_modified']
+
+        response = self.session.get(
+            url,
+            headers=headers,
+            timeout=10.0,
+            stream=True,
         )
+        if response.status_code == 304:
+            response.close()
+            return None
+        response.raise_for_status()
+
+        # Only recorded on the source once the document has been stored.
+        self.validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+        response.raw.decode_content = True
+        return self._parse_document(response.raw)
+
+    @classmethod
+    def _parse_document(cls, stream):
+        """ Gathers the Runmeter fields from a KML document.
+
+        The document is parsed incrementally, and each element is
+        discarded as soon as it has been read.
+
+        """
+        document = {}
+        for _, element in etree.iterparse(stream, events=('end', )):
+            field = DOCUMENT_FIELDS.get(element.tag)
+            if field:
+                document[field] = element.text
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return document
 
     @classmethod
     def get_source_type(cls):
-        source_type, _ = LocationSourceType.objects.get_or_create(
-            name='Runmeter'
-        )
-        return source_type
+        return LocationSourceType.objects.get_for_name('Runmeter')
 
     @classmethod
     def get_source_from_user_and_url(cls, user, url, **additional_filters):
@@ -213,7 +379,7 @@ class RunmeterConsumer(object):
                 name="Runmeter Route at %s" % datetime.datetime.now(),
                 data={
                     'url': url,
-                    'known_points': {}
+                    'last_point_time': None,
                 },
                 user=user,
                 active=True,
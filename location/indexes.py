@@ -0,0 +1,136 @@
+import logging
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+logger = logging.getLogger(__name__)
+
+
+class Index(object):
+    """ An index supporting one of the consumers' frequent queries.
+
+    On PostgreSQL, an index having a ``condition`` is created as a
+    partial index; elsewhere, the condition's column is appended to the
+    indexed columns instead.  A ``brin`` index is only created as such on
+    PostgreSQL 9.5 or newer.
+
+    """
+    def __init__(self, name, table, columns, condition=None, brin=False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.condition = condition
+        self.brin = brin
+
+    def get_create_sql(self, connection):
+        quote = connection.ops.quote_name
+        columns = list(self.columns)
+        method = ''
+        where = ''
+        if connection.vendor == 'postgresql':
+            if self.brin and get_postgres_version(connection) >= 90500:
+                method = ' USING brin'
+            if self.condition:
+                where = ' WHERE %s' % quote(self.condition)
+        elif self.condition:
+            columns.append(self.condition)
+        return 'CREATE INDEX %s ON %s%s (%s)%s' % (
+            quote(self.name),
+            quote(self.table),
+            method,
+            ', '.join(quote(column) for column in columns),
+            where,
+        )
+
+
+# Created by post_syncdb for new databases; existing databases are
+# migrated, so changes here need a migration too.
+INDEXES = [
+    # RunmeterConsumer.process_active_sources
+    Index(
+        'location_source_type_active',
+        'location_locationsource',
+        ['type_id'],
+        condition='active',
+    ),
+    # RunmeterConsumer.get_source_from_user_and_url
+    Index(
+        'location_source_user_type_created',
+        'location_locationsource',
+        ['user_id', 'type_id', 'created'],
+    ),
+    # RunmeterConsumer.is_active
+    Index(
+        'location_snapshot_source_date',
+        'location_locationsnapshot',
+        ['source_id', 'date'],
+    ),
+    # RunmeterConsumer.process_message
+    Index(
+        'location_settings_runmeter_email',
+        'location_locationconsumersettings',
+        ['runmeter_email'],
+        condition='runmeter_enabled',
+    ),
+    # Snapshots are stored roughly in date order, so a BRIN index stays
+    # small while still allowing date ranges to be found quickly.
+    Index(
+        'location_snapshot_date',
+        'location_locationsnapshot',
+        ['date'],
+        brin=True,
+    ),
+]
+
+
+SUPPORTED_VENDORS = ('postgresql', 'sqlite', 'mysql', )
+
+
+def get_postgres_version(connection):
+    from django.db.backends.postgresql_psycopg2.version import get_version
+    return get_version(connection)
+
+
+def get_index_names(connection, table):
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s',
+            [table]
+        )
+        return set(row[0] for row in cursor.fetchall())
+    elif connection.vendor == 'sqlite':
+        cursor.execute(
+            'PRAGMA index_list(%s)' % connection.ops.quote_name(table)
+        )
+        return set(row[1] for row in cursor.fetchall())
+    elif connection.vendor == 'mysql':
+        cursor.execute(
+            'SHOW INDEX FROM %s' % connection.ops.quote_name(table)
+        )
+        return set(row[2] for row in cursor.fetchall())
+
+
+def create_indexes(using=DEFAULT_DB_ALIAS):
+    """ Creates any of ``INDEXES`` not already present in the database. """
+    connection = connections[using]
+    if connection.vendor not in SUPPORTED_VENDORS:
+        logger.warning(
+            'Unable to create indexes for database vendor %s.',
+            connection.vendor,
+        )
+        return
+    tables = connection.introspection.table_names()
+    existing = {}
+    cursor = connection.cursor()
+    for index in INDEXES:
+        if index.table not in tables:
+            continue
+        if index.table not in existing:
+            existing[index.table] = get_index_names(connection, index.table)
+        if index.name in existing[index.table]:
+            continue
+        logger.info('Creating index %s.', index.name)
+        cursor.execute(index.get_create_sql(connection))
+        existing[index.table].add(index.name)
+
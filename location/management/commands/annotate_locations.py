@@ -0,0 +1,43 @@
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from location.annotator import LocationAnnotator
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--loglevel',
+            default=None,
+        ),
+        make_option(
+            '--batch-size',
+            type='int',
+            default=None,
+            help='Number of snapshots to annotate at a time.',
+        ),
+        make_option(
+            '--limit',
+            type='int',
+            default=None,
+            help='Stop after annotating this many snapshots.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        # Only set logging if it isn't already configured
+        if options['loglevel'] is not None:
+            logging.basicConfig(
+                level=logging.getLevelName(options['loglevel'])
+            )
+
+        annotated = LocationAnnotator.annotate(
+            batch_size=options['batch_size'],
+            limit=options['limit'],
+        )
+        logger.info('Annotated %s snapshot(s).', annotated)
@@ -0,0 +1,28 @@
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from location.signals import OutboxDispatcher
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--loglevel',
+            default=None,
+        ),
+    )
+
+    def handle(self, *args, **options):
+        # Only set logging if it isn't already configured
+        if options['loglevel'] is not None:
+            logging.basicConfig(
+                level=logging.getLevelName(options['loglevel'])
+            )
+
+        dispatched = OutboxDispatcher.dispatch()
+        logger.info('Dispatched %s location signal(s).', dispatched)
@@ -1,10 +1,14 @@
 import logging
 from optparse import make_option
+import signal
+import threading
+import time
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection
 
 from location.settings import SETTINGS
+from location.utils import after_commit, transaction_scope
 
 
 logger = logging.getLogger(__name__)
@@ -18,6 +22,13 @@ def get_class_by_path(path):
     return mod
 
 
+def get_interval_for_consumer(path):
+    return SETTINGS['periodic_consumer_intervals'].get(
+        path,
+        SETTINGS['periodic_interval_seconds']
+    )
+
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,9 +38,17 @@ class Command(BaseCommand):
             '--loglevel',
             default=None,
         ),
+        make_option(
+            '--daemon',
+            action='store_true',
+            default=False,
+            help=(
+                'Keep running, executing each periodic consumer at its '
+                'configured interval until receiving SIGTERM or SIGINT.'
+            )
+        ),
     )
 
-    @transaction.commit_on_success
     def handle(self, *args, **options):
         # Only set logging if it isn't already configured
         if options['loglevel'] is not None:
@@ -37,12 +56,83 @@ class Command(BaseCommand):
                 level=logging.getLevelName(options['loglevel'])
             )
 
+        if options['daemon']:
+            self.run_daemon()
+        else:
+            self.run_once()
+
+    def run_once(self):
         for consumer_path in SETTINGS['periodic_consumers']:
-            logger.info("Running periodic consumer '%s'.", consumer_path)
             try:
                 consumer_cls = get_class_by_path(consumer_path)
-                consumer_cls.periodic()
             except ImportError:
                 logger.exception('Unable to import consumer.')
-            except:
-                logger.exception('Error encountered while executing consumer.')
+                continue
+            self.run_consumer(consumer_path, consumer_cls)
+
+    def run_consumer(self, consumer_path, consumer_cls):
+        logger.info("Running periodic consumer '%s'.", consumer_path)
+        try:
+            with after_commit():
+                with transaction_scope('consumer'):
+                    consumer_cls.periodic()
+        except:
+            logger.exception('Error encountered while executing consumer.')
+
+    def run_daemon(self):
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            logger.info(
+                'Received signal %s; stopping once running consumers '
+                'finish.',
+                signum,
+            )
+            stopping.set()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Each consumer runs in its own thread so that a slow consumer
+        # can't delay the others, and so that a consumer's next run can't
+        # begin until its previous run has finished.
+        threads = []
+        for consumer_path in SETTINGS['periodic_consumers']:
+            try:
+                consumer_cls = get_class_by_path(consumer_path)
+            except ImportError:
+                logger.exception('Unable to import consumer.')
+                continue
+            thread = threading.Thread(
+                target=self.run_consumer_periodically,
+                args=(consumer_path, consumer_cls, stopping, ),
+                name=consumer_path,
+            )
+            thread.start()
+            threads.append(thread)
+
+        while not stopping.is_set():
+            # Waiting with a timeout allows signals to be handled.
+            stopping.wait(1)
+        for thread in threads:
+            thread.join()
+
+    def run_consumer_periodically(self, consumer_path, consumer_cls, stopping):
+        interval = get_interval_for_consumer(consumer_path)
+        while not stopping.is_set():
+            started = time.time()
+            # Nothing may end this thread early; the daemon would keep
+            # running without the consumer.
+            try:
+                try:
+                    self.run_consumer(consumer_path, consumer_cls)
+                finally:
+                    # Connections are per-thread; don't hold one open while
+                    # idle.
+                    connection.close()
+            except Exception:
+                logger.exception(
+                    "Error encountered while running periodic consumer "
+                    "'%s'.",
+                    consumer_path,
+                )
+            stopping.wait(max(interval - (time.time() - started), 0))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import connections, models
+
+
+# The indexes as of this migration: (name, table, columns, condition,
+# brin); see location.indexes.Index.
+INDEXES = [
+    (
+        'location_source_type_active',
+        'location_locationsource',
+        ['type_id'],
+        'active',
+        False,
+    ),
+    (
+        'location_source_user_type_created',
+        'location_locationsource',
+        ['user_id', 'type_id', 'created'],
+        None,
+        False,
+    ),
+    (
+        'location_snapshot_source_date',
+        'location_locationsnapshot',
+        ['source_id', 'date'],
+        None,
+        False,
+    ),
+    (
+        'location_settings_runmeter_email',
+        'location_locationconsumersettings',
+        ['runmeter_email'],
+        'runmeter_enabled',
+        False,
+    ),
+    (
+        'location_snapshot_date',
+        'location_locationsnapshot',
+        ['date'],
+        None,
+        True,
+    ),
+]
+
+
+def get_index_names(connection, table):
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s',
+            [table]
+        )
+        return set(row[0] for row in cursor.fetchall())
+    elif connection.vendor == 'sqlite':
+        cursor.execute(
+            'PRAGMA index_list(%s)' % connection.ops.quote_name(table)
+        )
+        return set(row[1] for row in cursor.fetchall())
+    elif connection.vendor == 'mysql':
+        cursor.execute(
+            'SHOW INDEX FROM %s' % connection.ops.quote_name(table)
+        )
+        return set(row[2] for row in cursor.fetchall())
+    return None
+
+
+def get_create_sql(connection, table, name, columns, condition, brin):
+    quote = connection.ops.quote_name
+    columns = list(columns)
+    method = ''
+    where = ''
+    if connection.vendor == 'postgresql':
+        from django.db.backends.postgresql_psycopg2.version import (
+            get_version
+        )
+        if brin and get_version(connection) >= 90500:
+            method = ' USING brin'
+        if condition:
+            where = ' WHERE %s' % quote(condition)
+    elif condition:
+        columns.append(condition)
+    return 'CREATE INDEX %s ON %s%s (%s)%s' % (
+        quote(name),
+        quote(table),
+        method,
+        ', '.join(quote(column) for column in columns),
+        where,
+    )
+
+
+def get_drop_sql(connection, table, name):
+    quote = connection.ops.quote_name
+    if connection.vendor == 'mysql':
+        return 'DROP INDEX %s ON %s' % (quote(name), quote(table))
+    return 'DROP INDEX %s' % quote(name)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding the indexes used by the consumers' frequent queries
+        if db.dry_run:
+            return
+        connection = connections[db.db_alias]
+        for name, table, columns, condition, brin in INDEXES:
+            existing = get_index_names(connection, table)
+            if existing is None or name in existing:
+                continue
+            db.execute(
+                get_create_sql(
+                    connection, table, name, columns, condition, brin
+                )
+            )
+
+
+    def backwards(self, orm):
+        # Removing the indexes used by the consumers' frequent queries
+        if db.dry_run:
+            return
+        connection = connections[db.db_alias]
+        for name, table, columns, condition, brin in INDEXES:
+            existing = get_index_names(connection, table)
+            if existing is None or name not in existing:
+                continue
+            db.execute(get_drop_sql(connection, table, name))
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'location.currentlocation': {
+            'Meta': {'object_name': 'CurrentLocation'},
+            'date': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'snapshot': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'current_locations'", 'to': u"orm['location.LocationSnapshot']"}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'current_location'", 'unique': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'location.locationconsumersettings': {
+            'Meta': {'object_name': 'LocationConsumerSettings'},
+            'icloud_device_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'icloud_enabled': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'icloud_next_poll': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'icloud_password': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'icloud_poll_interval': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'icloud_timezone': ('django.db.models.fields.CharField', [], {'default': "'US/Pacific'", 'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'icloud_username': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'runmeter_email': ('django.db.models.fields.EmailField', [], {'max_length': '255'}),
+            'runmeter_enabled': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'location_consumer_settings'", 'unique': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'location.locationsnapshot': {
+            'Meta': {'object_name': 'LocationSnapshot', 'index_together': "[('user', 'date')]"},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'location': ('django.contrib.gis.db.models.fields.PointField', [], {'geography': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'points'", 'null': 'True', 'to': u"orm['location.LocationSource']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'location_snapshots'", 'null': 'True', 'db_index': 'False', 'blank': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'location.locationsource': {
+            'Meta': {'object_name': 'LocationSource'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['location.LocationSourceType']"}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'location_sources'", 'null': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'location.locationsourcetype': {
+            'Meta': {'object_name': 'LocationSourceType'},
+            'icon': ('django.db.models.fields.files.ImageField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'location.signaloutboxentry': {
+            'Meta': {'object_name': 'SignalOutboxEntry'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'signal': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'location_signal_outbox'", 'to': u"orm['auth.User']"})
+        }
+    }
+
+    complete_apps = ['location']
\ No newline at end of file
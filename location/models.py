@@ -1,14 +1,23 @@
 import datetime
 import logging
+import threading
+import time
+import uuid
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.fields import GeometryField
+from django.contrib.gis.geos import MultiPoint, Polygon
 from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models.signals import post_delete, post_save, post_syncdb
 from django.dispatch import receiver
 from django_mailbox.signals import message_received
 from jsonfield.fields import JSONField
 
+from location.boundaries import get_boundary_index
 from location.settings import SETTINGS
+from location.utils import BoundedCache, get_geohash_cell
 
 
 logger = logging.getLogger('location.models')
@@ -31,6 +40,60 @@ except ImportError:
     )
     Neighborhood = None
 
+# Cached in place of a location detail known not to exist.
+NOT_FOUND = 'LOCATION:NOT_FOUND'
+
+LOCATION_DETAILS = ('city', 'neighborhood', 'nearest_city', )
+
+# Details stored by the annotator, and the fields storing them.
+STORED_DETAILS = {
+    'city': 'city_id',
+    'neighborhood': 'neighborhood_id',
+}
+
+# Details that can be shared by every point within a cell containing them.
+CELL_LOCATION_DETAILS = ('city', 'neighborhood', )
+
+
+def get_geometry_field_name(model):
+    """ Returns the name of a model's first geometry field, if it has one.
+    """
+    meta = getattr(model, '_meta', None)
+    if meta is None:
+        return None
+    for field in meta.fields:
+        if isinstance(field, GeometryField):
+            return field.name
+    return None
+
+
+def get_enabled_boundary_index(model):
+    if not SETTINGS['boundary_index']:
+        return None
+    field_name = get_geometry_field_name(model)
+    if field_name is None:
+        return None
+    return get_boundary_index(model, field_name)
+
+
+def get_boundary_lookup(model, method):
+    """ Returns the function finding boundaries of ``model`` using the
+    boundary index if it is enabled, or using ``model``'s ``method``.
+
+    """
+    index = get_enabled_boundary_index(model)
+    if index is not None:
+        return getattr(index, method)
+    return getattr(model, method)
+
+
+def get_geometry(instance):
+    """ Returns the first geometry of a model instance, if it has one. """
+    field_name = get_geometry_field_name(instance)
+    if field_name is None:
+        return None
+    return getattr(instance, field_name)
+
 
 class LocationConsumerSettings(models.Model):
     user = models.OneToOneField(
@@ -67,6 +130,18 @@ class LocationConsumerSettings(models.Model):
             "location updates"
         )
     )
+    icloud_next_poll = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    icloud_poll_interval = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text=(
+            "Number of seconds between iCloud location updates; adjusted "
+            "automatically as the device moves or stays in place"
+        )
+    )
     runmeter_enabled = models.BooleanField(default=False)
     runmeter_email = models.EmailField(
         max_length=255,
@@ -86,14 +161,83 @@ class LocationConsumerSettings(models.Model):
         verbose_name_plural = 'Location Consumer Settings'
 
 
+class LocationSourceTypeManager(models.Manager):
+    # Source types are looked up by every consumer, but rarely change;
+    # each process caches them until it notices that any process has
+    # changed a source type (as recorded in the shared cache), or for
+    # ``source_type_ttl_seconds`` should the shared cache not be shared by
+    # every process.
+    _cache = BoundedCache(
+        SETTINGS['source_type_cache_size'],
+        ttl=SETTINGS['source_type_ttl_seconds'],
+    )
+    _cache_lock = threading.RLock()
+    _version = {
+        'version': None,
+        'checked': None,
+    }
+
+    def get_version_cache_key(self):
+        return '%s:LocationSourceType:version' % SETTINGS['cache_prefix']
+
+    def check_version(self):
+        """ Clears the cached source types if any process has changed a
+        source type, checking at most every ``source_type_check_seconds``.
+
+        """
+        now = time.time()
+        checked = self._version['checked']
+        if (
+            checked is not None
+            and now - checked < SETTINGS['source_type_check_seconds']
+        ):
+            return
+        version = cache.get(self.get_version_cache_key())
+        if version != self._version['version']:
+            self._cache.clear()
+            self._version['version'] = version
+        self._version['checked'] = now
+
+    def get_for_name(self, name):
+        """ Returns the source type named ``name``, creating it if
+        necessary.
+
+        """
+        with self._cache_lock:
+            self.check_version()
+            source_type = self._cache.get(name)
+            if source_type is not None:
+                return source_type
+            try:
+                source_type, created = self.get_or_create(name=name)
+            except IntegrityError:
+                # Created by another process since it was looked for
+                source_type, created = self.get(name=name), False
+            # Not cached until it's found again, in case the transaction
+            # creating it is rolled back.
+            if not created:
+                self._cache.set(name, source_type)
+            return source_type
+
+    def clear_cache(self):
+        """ Clears the cached source types of every process. """
+        with self._cache_lock:
+            self._cache.clear()
+            version = uuid.uuid4().hex
+            cache.set(self.get_version_cache_key(), version)
+            self._version['version'] = version
+
+
 class LocationSourceType(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
     icon = models.ImageField(
         null=True,
         blank=True,
         upload_to='source_type_icons/'
     )
 
+    objects = LocationSourceTypeManager()
+
     def __unicode__(self):
         return self.name
 
@@ -111,6 +255,12 @@ class LocationSource(models.Model):
         default=None,
     )
     type = models.ForeignKey(LocationSourceType)
+    # The source's identifier within its service (e.g. a check-in id).
+    external_id = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+    )
     data = JSONField()
     created = models.DateTimeField(
         auto_now_add=True
@@ -128,6 +278,11 @@ class LocationSource(models.Model):
             self.name,
         )
 
+    class Meta:
+        unique_together = (
+            ('type', 'external_id', ),
+        )
+
 
 class LocationSnapshot(models.Model):
     location = models.PointField(
@@ -140,6 +295,20 @@ class LocationSnapshot(models.Model):
         null=True,
         blank=True
     )
+    # Copied from the source so that a user's snapshots can be found
+    # without joining through their sources.
+    user = models.ForeignKey(
+        getattr(
+            settings,
+            'AUTH_USER_MODEL',
+            'auth.User'
+        ),
+        related_name='location_snapshots',
+        null=True,
+        blank=True,
+        default=None,
+        db_index=False,
+    )
     date = models.DateTimeField(
         default=datetime.datetime.now
     )
@@ -148,8 +317,30 @@ class LocationSnapshot(models.Model):
         auto_now_add=True
     )
 
+    # Stored by the annotator; these refer to django-census-places'
+    # PlaceBoundary and django-neighborhoods' Neighborhood, which are
+    # optional, so they can't be foreign keys.
+    city_id = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+    )
+    neighborhood_id = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+    )
+    geocoded = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+
     objects = models.GeoManager()
 
+    def save(self, *args, **kwargs):
+        if self.user_id is None and self.source is not None:
+            self.user_id = self.source.user_id
+        return super(LocationSnapshot, self).save(*args, **kwargs)
+
     def get_cache_key(self, name):
         return '%s:%s:%s:%s' % (
             SETTINGS['cache_prefix'],
@@ -164,53 +355,388 @@ class LocationSnapshot(models.Model):
     def set_cached(self, name, value):
         cache.set(self.get_cache_key(name), value, 60 * 60 * 24)
 
+    def get_cell(self):
+        precision = SETTINGS['location_detail_cell_precision']
+        if not precision or self.location is None:
+            return None
+        if '_cell_cache' not in self.__dict__:
+            self._cell_cache = get_geohash_cell(self.location, precision)
+        return self._cell_cache
+
+    def get_cell_cache_key(self, name):
+        cell = self.get_cell()
+        if name not in CELL_LOCATION_DETAILS or cell is None:
+            return None
+        return '%s:%s:cell:%s:%s' % (
+            SETTINGS['cache_prefix'],
+            self.__class__.__name__,
+            cell[0],
+            name
+        )
+
+    def set_cell_cached(self, name, value):
+        """ Caches ``value`` for every point in this snapshot's cell if its
+        geometry contains the whole cell.
+
+        """
+        key = self.get_cell_cache_key(name)
+        if key is None:
+            return
+        geometry = get_geometry(value)
+        if geometry is None or geometry.srid not in (None, 4326, ):
+            return
+        cell = Polygon.from_bbox(self.get_cell()[1])
+        if geometry.contains(cell):
+            cache.set(key, value, 60 * 60 * 24)
+
     @property
-    def city(self):
-        if PlaceBoundary:
-            cached = self.get_cached('city')
-            if cached:
-                return cached
+    def _location_details(self):
+        if '_location_details_cache' not in self.__dict__:
+            self._location_details_cache = {}
+        return self._location_details_cache
+
+    def _get_location_detail(self, name, model, method):
+        if not model:
+            return None
+        details = self._location_details
+        if name not in details:
+            cached = self.get_cached(name)
+            cell_key = self.get_cell_cache_key(name)
+            if cached is None and cell_key is not None:
+                cached = cache.get(cell_key)
+            if cached is None and self.geocoded and name in STORED_DETAILS:
+                cached = self._get_stored_location_detail(name, model)
+            if cached is None:
+                try:
+                    cached = get_boundary_lookup(model, method)(
+                        self.location
+                    )
+                except model.DoesNotExist:
+                    cached = None
+                self._store_location_detail(name, cached)
+            details[name] = None if cached == NOT_FOUND else cached
+        return details[name]
+
+    def _get_stored_location_detail(self, name, model):
+        stored_id = getattr(self, STORED_DETAILS[name])
+        value = None
+        if stored_id is not None:
             try:
-                result = PlaceBoundary.get_containing(self.location)
-                self.set_cached('city', result)
-                return result
-            except PlaceBoundary.DoesNotExist:
+                value = model.objects.get(pk=stored_id)
+            except model.DoesNotExist:
                 pass
-        return None
+        self.set_cached(name, NOT_FOUND if value is None else value)
+        return NOT_FOUND if value is None else value
+
+    def _store_location_detail(self, name, value):
+        # Misses are cached too, as they are just as slow to find; they're
+        # never shared with the rest of the cell, though, as part of the
+        # cell may lie within a boundary.
+        self.set_cached(name, NOT_FOUND if value is None else value)
+        if value is not None:
+            self.set_cell_cached(name, value)
+        self._location_details[name] = value
+
+    @classmethod
+    def load_location_details(cls, snapshots):
+        """ Finds the cities and neighborhoods of ``snapshots``.
+
+        Details not already cached are found using a single query for
+        each kind of boundary, rather than one for each snapshot.
+
+        """
+        snapshots = list(snapshots)
+        cls.prefetch_location_details(snapshots)
+        for name, model in (
+            ('city', PlaceBoundary, ),
+            ('neighborhood', Neighborhood, ),
+        ):
+            field_name = get_geometry_field_name(model)
+            if not model or field_name is None:
+                continue
+            pending = [
+                snapshot for snapshot in snapshots
+                if name not in snapshot._location_details
+                and snapshot.location is not None
+            ]
+
+            # Annotated snapshots already know their boundary's id.
+            annotated = [
+                snapshot for snapshot in pending if snapshot.geocoded
+            ]
+            if annotated:
+                stored = model.objects.in_bulk([
+                    getattr(snapshot, STORED_DETAILS[name])
+                    for snapshot in annotated
+                    if getattr(snapshot, STORED_DETAILS[name]) is not None
+                ])
+                for snapshot in annotated:
+                    snapshot._store_location_detail(
+                        name,
+                        stored.get(getattr(snapshot, STORED_DETAILS[name]))
+                    )
+                pending = [
+                    snapshot for snapshot in pending
+                    if not snapshot.geocoded
+                ]
+            if not pending:
+                continue
+            index = get_enabled_boundary_index(model)
+            if index is not None:
+                # Looking each snapshot up in the index is cheaper than
+                # querying the database for the whole batch.
+                for snapshot in pending:
+                    try:
+                        containing = index.get_containing(snapshot.location)
+                    except model.DoesNotExist:
+                        containing = None
+                    snapshot._store_location_detail(name, containing)
+                continue
+            boundaries = list(
+                model.objects.filter(**{
+                    '%s__intersects' % field_name: MultiPoint(
+                        [snapshot.location for snapshot in pending],
+                        srid=4326,
+                    )
+                })
+            )
+            for snapshot in pending:
+                containing = None
+                for boundary in boundaries:
+                    if get_geometry(boundary).contains(snapshot.location):
+                        containing = boundary
+                        break
+                snapshot._store_location_detail(name, containing)
+
+    @classmethod
+    def prefetch_location_details(cls, snapshots, names=LOCATION_DETAILS):
+        """ Loads the cached location details of ``snapshots`` using a
+        single cache request.
+
+        """
+        keys = {}
+        cell_keys = {}
+        for snapshot in snapshots:
+            if snapshot.pk is None:
+                continue
+            for name in names:
+                if name not in snapshot._location_details:
+                    keys[snapshot.get_cache_key(name)] = (snapshot, name, )
+                    cell_key = snapshot.get_cell_cache_key(name)
+                    if cell_key is not None:
+                        cell_keys.setdefault(cell_key, []).append(
+                            (snapshot, name, )
+                        )
+        if not keys:
+            return
+        values = cache.get_many(keys.keys() + cell_keys.keys())
+        for key, value in values.items():
+            if key in keys:
+                snapshot, name = keys[key]
+                snapshot._location_details[name] = (
+                    None if value == NOT_FOUND else value
+                )
+        # Cell entries only fill details not cached for the snapshot itself.
+        for key, value in values.items():
+            for snapshot, name in cell_keys.get(key, []):
+                if name not in snapshot._location_details:
+                    snapshot._location_details[name] = value
+
+    @property
+    def city(self):
+        return self._get_location_detail(
+            'city',
+            PlaceBoundary,
+            'get_containing',
+        )
 
     @property
     def neighborhood(self):
-        if Neighborhood:
-            cached = self.get_cached('neighborhood')
-            if cached:
-                return cached
-            try:
-                result = Neighborhood.get_containing(self.location)
-                self.set_cached('neighborhood', result)
-                return result
-            except Neighborhood.DoesNotExist:
-                pass
-        return None
+        return self._get_location_detail(
+            'neighborhood',
+            Neighborhood,
+            'get_containing',
+        )
 
     def find_nearest_city(self):
-        if PlaceBoundary:
-            cached = self.get_cached('nearest_city')
-            if cached:
-                return cached
-            try:
-                result = PlaceBoundary.get_nearest_to(self.location)
-                self.set_cached('nearest_city', result)
-                return result
-            except PlaceBoundary.DoesNotExist:
-                pass
-        return None
+        return self._get_location_detail(
+            'nearest_city',
+            PlaceBoundary,
+            'get_nearest_to',
+        )
 
     def __unicode__(self):
         return u"%s's location at %s" % (
-            self.source.user,
+            self.user,
             self.date
         )
 
+    class Meta:
+        # Ordering a user's snapshots by date scans this index backwards.
+        index_together = [
+            ('user', 'date', ),
+        ]
+
+
+class CurrentLocation(models.Model):
+    user = models.OneToOneField(
+        getattr(
+            settings,
+            'AUTH_USER_MODEL',
+            'auth.User'
+        ),
+        related_name='current_location',
+    )
+    snapshot = models.ForeignKey(
+        LocationSnapshot,
+        related_name='current_locations',
+    )
+    date = models.DateTimeField()
+
+    @classmethod
+    def update_for_snapshot(cls, snapshot):
+        """ Records ``snapshot`` as its user's current location if it is
+        newer than the one currently recorded.
+
+        """
+        if snapshot.user_id is None:
+            return
+        current, created = cls.objects.get_or_create(
+            user_id=snapshot.user_id,
+            defaults={
+                'snapshot': snapshot,
+                'date': snapshot.date,
+            }
+        )
+        if not created and current.date < snapshot.date:
+            cls.objects.filter(
+                pk=current.pk,
+                date__lt=snapshot.date,
+            ).update(
+                snapshot=snapshot,
+                date=snapshot.date,
+            )
+
+    @classmethod
+    def refresh_for_user(cls, user_id):
+        """ Recalculates the user's current location from their history. """
+        cls.objects.filter(user_id=user_id).delete()
+        try:
+            snapshot = LocationSnapshot.objects.filter(
+                user=user_id,
+            ).order_by('-date')[0]
+        except IndexError:
+            return
+        cls.update_for_snapshot(snapshot)
+
+    def __unicode__(self):
+        return u"%s's current location" % (
+            self.user,
+        )
+
+
+@receiver(
+    post_save, sender=LocationSnapshot, dispatch_uid='update_current_loc'
+)
+def update_current_location(sender, instance, raw=False, **kwargs):
+    if not raw:
+        CurrentLocation.update_for_snapshot(instance)
+
+
+@receiver(
+    post_delete, sender=LocationSnapshot, dispatch_uid='refresh_current_loc'
+)
+def refresh_current_location(sender, instance, **kwargs):
+    # Deleting a user's current snapshot also deletes their current
+    # location; fall back to the newest snapshot remaining.
+    if (
+        instance.user_id is not None
+        and not CurrentLocation.objects.filter(
+            user=instance.user_id
+        ).exists()
+    ):
+        CurrentLocation.refresh_for_user(instance.user_id)
+
+
+class SignalOutboxEntry(models.Model):
+    SIGNAL_CHOICES = (
+        ('location_updated', 'Location Updated', ),
+        ('location_changed', 'Location Changed', ),
+        ('locations_ingested', 'Locations Ingested', ),
+    )
+
+    signal = models.CharField(
+        max_length=50,
+        choices=SIGNAL_CHOICES,
+    )
+    user = models.ForeignKey(
+        getattr(
+            settings,
+            'AUTH_USER_MODEL',
+            'auth.User'
+        ),
+        related_name='location_signal_outbox',
+    )
+    data = JSONField()
+    created = models.DateTimeField(
+        auto_now_add=True
+    )
+    attempts = models.PositiveIntegerField(
+        default=0
+    )
+    next_attempt = models.DateTimeField(
+        db_index=True
+    )
+    last_error = models.TextField(
+        null=True,
+        blank=True,
+    )
+
+    def __unicode__(self):
+        return u"%s for %s" % (
+            self.signal,
+            self.user,
+        )
+
+    class Meta:
+        verbose_name = 'Signal Outbox Entry'
+        verbose_name_plural = 'Signal Outbox Entries'
+
+
+class PendingCheckin(models.Model):
+    checkin_id = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        unique=True,
+    )
+    data = models.TextField()
+    received = models.DateTimeField(
+        auto_now_add=True
+    )
+    attempts = models.PositiveIntegerField(
+        default=0
+    )
+    last_error = models.TextField(
+        null=True,
+        blank=True,
+    )
+
+    def __unicode__(self):
+        return u"Foursquare check-in received at %s" % (
+            self.received,
+        )
+
+
+@receiver(
+    post_save, sender=LocationSourceType, dispatch_uid='clear_source_types'
+)
+@receiver(
+    post_delete, sender=LocationSourceType, dispatch_uid='clear_source_types'
+)
+def clear_source_type_cache(sender, **kwargs):
+    LocationSourceType.objects.clear_cache()
+
 
 @receiver(message_received, dispatch_uid='process_incoming_runmeter_msg')
 def process_incoming_runmeter_message(sender, message, **kwargs):
@@ -224,3 +750,10 @@ def process_incoming_runmeter_message(sender, message, **kwargs):
                 'No user is currently assigned to from_address %s',
                 message.from_address
             )
+
+
+@receiver(post_syncdb, dispatch_uid='create_location_indexes')
+def create_location_indexes(sender, app, db=None, **kwargs):
+    from location.indexes import create_indexes
+    if app.__name__ == __name__:
+        create_indexes(db or 'default')
@@ -6,19 +6,89 @@ from django.conf import settings
 DEFAULT_SETTINGS = {
     'cache_prefix': 'LOCATION',
     'runmeter_mailbox': None,
+    # Geohash precision of the cells sharing cached cities and
+    # neighborhoods; None caches them for each snapshot only.
+    'location_detail_cell_precision': None,
+    # Look up cities and neighborhoods using an in-memory index of every
+    # boundary, built by each process when first needed; requires Shapely.
+    'boundary_index': False,
+    # Source types each process remembers, and how often it checks
+    # whether another process has changed a source type
+    'source_type_cache_size': 100,
+    'source_type_ttl_seconds': 300,
+    'source_type_check_seconds': 10,
+    # One of 'consumer', 'source', or 'batch'
+    'transaction_scope': 'consumer',
+    # One of 'sync' or 'outbox'
+    'signal_dispatch': 'sync',
+    'outbox': {
+        'batch_size': 100,
+        'max_attempts': 5,
+        'retry_delay_seconds': 60,
+        'lease_seconds': 300,
+    },
     'icloud': {
         'min_horizontal_accuracy': 20,
         'max_wait_seconds': 120,
         'request_interval_seconds': 5,
+        'workers': 8,
+        'deadline_seconds': 600,
+        'session_ttl_seconds': 1800,
+        'session_cache_size': 100,
+        'poll_interval_seconds': 300,
+        'min_poll_interval_seconds': 60,
+        'max_poll_interval_seconds': 3600,
+        'stationary_distance_meters': 100,
+        'moving_speed_meters_per_second': 10,
+    },
+    'runmeter': {
+        'batch_size': 500,
+        'workers': 4,
+    },
+    'foursquare': {
+        'queue_checkins': False,
+        'batch_size': 100,
+        'max_attempts': 5,
+        # How long to remember check-ins that have been received
+        'seen_ttl_seconds': 60 * 60 * 24 * 7,
+        # Foursquare users whose Django user is remembered by each process
+        'user_cache_size': 100,
+        'user_ttl_seconds': 300,
+    },
+    'annotator': {
+        'batch_size': 500,
     },
     'periodic_consumers': [
         'location.consumers.runmeter.RunmeterConsumer',
         'location.consumers.icloud.iCloudConsumer',
-    ]
+        'location.consumers.foursquare.FoursquareConsumer',
+    ],
+    'periodic_interval_seconds': 300,
+    'periodic_consumer_intervals': {
+        'location.consumers.icloud.iCloudConsumer': 60,
+        'location.consumers.foursquare.FoursquareConsumer': 10,
+    },
 }
 
-SETTINGS = copy.deepcopy(DEFAULT_SETTINGS)
-SETTINGS.update(
+
+def merge_settings(defaults, overrides):
+    """ Returns ``defaults`` updated with ``overrides``.
+
+    Sections (e.g. ``foursquare``) are merged too, so that overriding
+    one of a section's settings leaves its others at their defaults.
+
+    """
+    merged = copy.deepcopy(defaults)
+    for name, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict):
+            merged[name] = merge_settings(merged[name], value)
+        else:
+            merged[name] = value
+    return merged
+
+
+SETTINGS = merge_settings(
+    DEFAULT_SETTINGS,
     getattr(
         settings,
         'DJANGO_LOCATION_SETTINGS',
@@ -1,35 +1,150 @@
+import datetime
+import logging
+import threading
+
+from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.dispatch.dispatcher import Signal
+from django.utils.timezone import utc
+
+from location.models import (
+    CurrentLocation,
+    LocationSnapshot,
+    LocationSource,
+    SignalOutboxEntry
+)
+from location.settings import SETTINGS
 
-from location.models import LocationSnapshot
+
+logger = logging.getLogger(__name__)
 
 
 location_updated = Signal(providing_args=['user', 'from_', 'to'])
 location_changed = Signal(providing_args=['user', 'from_', 'to'])
+locations_ingested = Signal(
+    providing_args=['user', 'snapshots', 'from_', 'to']
+)
+
+SIGNALS = {
+    'location_updated': location_updated,
+    'location_changed': location_changed,
+    'locations_ingested': locations_ingested,
+}
+
+_watchers = threading.local()
+
+
+def _get_active_watchers():
+    if not hasattr(_watchers, 'active'):
+        _watchers.active = []
+    return _watchers.active
+
+
+def register_snapshots(snapshots):
+    """ Informs active ``watch_location`` blocks of stored snapshots.
+
+    Snapshots saved individually are registered automatically; this is
+    only necessary for snapshots stored without sending ``post_save``,
+    for example using ``bulk_create``.
+
+    """
+    watchers = _get_active_watchers()
+    if not watchers:
+        return
+    snapshots = list(snapshots)
+
+    # Snapshots created using ``bulk_create`` aren't given their source's
+    # user unless it's set explicitly.
+    source_ids = set(
+        snapshot.source_id for snapshot in snapshots
+        if snapshot.user_id is None
+    )
+    source_users = {}
+    if source_ids:
+        source_users = dict(
+            LocationSource.objects.filter(
+                pk__in=source_ids
+            ).values_list('pk', 'user')
+        )
+
+    for snapshot in snapshots:
+        user_id = snapshot.user_id
+        if user_id is None:
+            user_id = source_users.get(snapshot.source_id)
+        for watcher in watchers:
+            if watcher.user_id == user_id:
+                watcher.snapshots.append(snapshot)
+
+
+@receiver(
+    post_save, sender=LocationSnapshot, dispatch_uid='register_watched_loc'
+)
+def register_saved_snapshot(sender, instance, created=False, raw=False,
+                            **kwargs):
+    if created and not raw:
+        register_snapshots([instance])
 
 
 class watch_location(object):
+    """ Sends location signals for the snapshots of ``user`` stored while
+    watching.
+
+    ``user`` may be a user or a user's id; in the latter case the user is
+    loaded only if a signal is sent to its receivers.
+
+    """
     def __init__(self, user):
-        self.user = user
+        if isinstance(user, models.Model):
+            self._user = user
+            self.user_id = user.pk
+        else:
+            self._user = None
+            self.user_id = user
+        self.snapshots = []
+
+    @property
+    def user(self):
+        if self._user is None:
+            user_model = CurrentLocation._meta.get_field('user').rel.to
+            self._user = user_model.objects.get(pk=self.user_id)
+        return self._user
 
     def _get_current_location(self):
-        return LocationSnapshot.objects.filter(
-            source__user=self.user,
-        ).order_by('-date')[0]
+        try:
+            return CurrentLocation.objects.select_related(
+                'snapshot'
+            ).get(
+                user=self.user_id,
+            ).snapshot
+        except CurrentLocation.DoesNotExist:
+            return None
+
+    def _get_newest_location(self):
+        if not self.snapshots:
+            # Nothing was registered while watching; the location may
+            # still have been changed by other means.
+            return self._get_current_location()
+        newest = max(self.snapshots, key=lambda snapshot: snapshot.date)
+        if (
+            self.original_location is not None
+            and self.original_location.date >= newest.date
+        ):
+            return self.original_location
+        return newest
 
     def __enter__(self):
-        self.original_location = None
-        try:
-            self.original_location = self._get_current_location()
-        except IndexError:
-            pass
+        self.original_location = self._get_current_location()
+        self.snapshots = []
+        _get_active_watchers().append(self)
         return self
 
     def __exit__(self, *args):
-        current_location = self._get_current_location()
+        _get_active_watchers().remove(self)
+        current_location = self._get_newest_location()
         if self.original_location != current_location:
-            location_updated.send(
-                sender=self,
-                user=self.user,
+            self._send(
+                'location_updated',
                 from_=self.original_location,
                 to=current_location,
             )
@@ -38,9 +153,189 @@ class watch_location(object):
                 self.original_location.location
                 != current_location.location
             ):
-                location_changed.send(
-                    sender=self,
-                    user=self.user,
+                self._send(
+                    'location_changed',
                     from_=self.original_location,
                     to=current_location,
                 )
+        if self.snapshots:
+            self._send(
+                'locations_ingested',
+                snapshots=sorted(
+                    self.snapshots,
+                    key=lambda snapshot: snapshot.date
+                ),
+                from_=self.original_location,
+                to=current_location,
+            )
+
+    def _send(self, signal_name, **kwargs):
+        if SETTINGS['signal_dispatch'] == 'outbox':
+            SignalOutboxEntry.objects.create(
+                signal=signal_name,
+                user_id=self.user_id,
+                data=get_outbox_data(**kwargs),
+                next_attempt=datetime.datetime.utcnow().replace(tzinfo=utc),
+            )
+        else:
+            # Sent by the class, as they are when sent from the outbox.
+            SIGNALS[signal_name].send(
+                sender=watch_location,
+                user=self.user,
+                **kwargs
+            )
+
+
+def get_outbox_data(**kwargs):
+    data = {}
+    for name, value in kwargs.items():
+        if name == 'snapshots':
+            data[name] = [snapshot.pk for snapshot in value]
+        else:
+            data[name] = value.pk if value is not None else None
+    return data
+
+
+class OutboxDispatcher(object):
+    """ Sends the location signals stored in the outbox.
+
+    Signals are sent with ``watch_location`` as their sender; entries
+    whose receivers raise an exception are retried with an exponential
+    backoff, so receivers may see a signal more than once.  Entries are
+    discarded once they've been attempted ``max_attempts`` times.
+
+    """
+    @classmethod
+    def periodic(cls):
+        cls.dispatch()
+
+    @classmethod
+    def dispatch(cls):
+        cls.discard_abandoned_entries()
+        dispatched = 0
+        while True:
+            entries = cls.claim_due_entries()
+            if not entries:
+                break
+            snapshots = cls.get_snapshots(entries)
+            for entry in entries:
+                if cls.dispatch_entry(entry, snapshots):
+                    dispatched += 1
+        return dispatched
+
+    @classmethod
+    def discard_abandoned_entries(cls):
+        """ Deletes entries whose last attempt ended without them being
+        sent or discarded, e.g. because their dispatcher died.
+
+        """
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        abandoned = SignalOutboxEntry.objects.filter(
+            attempts__gte=SETTINGS['outbox']['max_attempts'],
+            next_attempt__lte=now,
+        )
+        for entry in abandoned:
+            logger.error(
+                'Giving up on sending %s (%s) after %s attempts.',
+                entry,
+                entry.data,
+                entry.attempts,
+            )
+        abandoned.delete()
+
+    @classmethod
+    def claim_due_entries(cls):
+        config = SETTINGS['outbox']
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        due = SignalOutboxEntry.objects.select_related('user').filter(
+            next_attempt__lte=now,
+            attempts__lt=config['max_attempts'],
+        ).order_by('pk')[:config['batch_size']]
+
+        # Entries are leased before being sent so that concurrent
+        # dispatchers don't send them twice, and so that they are sent
+        # again should this dispatcher die while sending them.
+        lease_until = now + datetime.timedelta(
+            seconds=config['lease_seconds']
+        )
+        claimed = []
+        for entry in due:
+            updated = SignalOutboxEntry.objects.filter(
+                pk=entry.pk,
+                attempts=entry.attempts,
+                next_attempt=entry.next_attempt,
+            ).update(
+                attempts=entry.attempts + 1,
+                next_attempt=lease_until,
+            )
+            if updated:
+                entry.attempts += 1
+                entry.next_attempt = lease_until
+                claimed.append(entry)
+        return claimed
+
+    @classmethod
+    def get_snapshots(cls, entries):
+        snapshot_ids = set()
+        for entry in entries:
+            for name, value in entry.data.items():
+                if name == 'snapshots':
+                    snapshot_ids.update(value)
+                elif value is not None:
+                    snapshot_ids.add(value)
+        if not snapshot_ids:
+            return {}
+        return LocationSnapshot.objects.in_bulk(list(snapshot_ids))
+
+    @classmethod
+    def dispatch_entry(cls, entry, snapshots):
+        kwargs = {}
+        for name, value in entry.data.items():
+            name = str(name)
+            if name == 'snapshots':
+                kwargs[name] = [
+                    snapshots[pk] for pk in value if pk in snapshots
+                ]
+            else:
+                kwargs[name] = snapshots.get(value)
+
+        responses = SIGNALS[entry.signal].send_robust(
+            sender=watch_location,
+            user=entry.user,
+            **kwargs
+        )
+        errors = [
+            response for _, response in responses
+            if isinstance(response, Exception)
+        ]
+        if not errors:
+            entry.delete()
+            return True
+
+        config = SETTINGS['outbox']
+        entry.last_error = u'\n'.join(repr(error) for error in errors)
+        entry.next_attempt = (
+            datetime.datetime.utcnow().replace(tzinfo=utc)
+            + datetime.timedelta(
+                seconds=config['retry_delay_seconds'] * 2 ** (
+                    entry.attempts - 1
+                )
+            )
+        )
+        if entry.attempts >= config['max_attempts']:
+            logger.error(
+                'Giving up on sending %s (%s) after %s attempts: %s',
+                entry,
+                entry.data,
+                entry.attempts,
+                entry.last_error,
+            )
+            entry.delete()
+        else:
+            entry.save()
+            logger.warning(
+                'Unable to send %s; will retry: %s',
+                entry,
+                entry.last_error,
+            )
+        return False
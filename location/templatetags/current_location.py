@@ -21,8 +21,8 @@ class LocationSnapshotNode(template.Node):
     def render(self, context):
         try:
             snapshot_query = LocationSnapshot.objects.filter(
-                source__user__username=self.username
-            ).order_by('-date')
+                current_locations__user__username=self.username
+            )
             if LOCATION_HOME:
                 snapshot_query = snapshot_query.distance(
                     Point(
@@ -1,9 +1,30 @@
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
+from location.models import LocationSourceType
+
+
+class Boundary(object):
+    """ Stands in for a PlaceBoundary or Neighborhood, which must be
+    picklable to be cached.
+
+    """
+    def __init__(self, pk, geog):
+        self.pk = pk
+        self.geog = geog
+
+    def __eq__(self, other):
+        return isinstance(other, Boundary) and self.pk == other.pk
+
+    def __ne__(self, other):
+        return not self == other
+
 
 class BaseTestCase(TestCase):
     def setUp(self):
+        cache.clear()
+        LocationSourceType.objects.clear_cache()
         self.user = User.objects.create(
             username='arbitrary_username',
         )
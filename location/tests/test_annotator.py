@@ -0,0 +1,78 @@
+import datetime
+
+from django.contrib.gis.geos import Point, Polygon
+from django.utils.timezone import utc
+from mock import MagicMock, patch
+
+from location import models
+from location.annotator import LocationAnnotator
+from location.tests.base import BaseTestCase, Boundary
+
+
+class LocationAnnotatorTest(BaseTestCase):
+    def setUp(self):
+        super(LocationAnnotatorTest, self).setUp()
+        self.source_type = models.LocationSourceType.objects.create(
+            name='Arbitrary Source Type'
+        )
+        self.source = models.LocationSource.objects.create(
+            name='Arbitrary Source',
+            type=self.source_type,
+            user=self.user,
+            active=False,
+            data={},
+        )
+
+        self.city = Boundary(7, Polygon.from_bbox((0, 0, 20, 20)))
+        self.place_boundary = MagicMock()
+        self.place_boundary.objects.filter.return_value = [self.city]
+        for name, value in (
+            ('PlaceBoundary', self.place_boundary, ),
+            ('Neighborhood', None, ),
+            ('get_geometry_field_name', lambda model: 'geog', ),
+            ('get_geometry', lambda boundary: boundary.geog, ),
+        ):
+            patcher = patch.object(models, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_snapshot(self, lng, lat):
+        return models.LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                lng,
+                lat
+            ),
+            date=datetime.datetime.utcnow().replace(tzinfo=utc)
+        )
+
+    def test_annotate(self):
+        inside = self.create_snapshot(10, 10)
+        outside = self.create_snapshot(30, 30)
+
+        annotated = LocationAnnotator.annotate(batch_size=1)
+
+        self.assertEqual(annotated, 2)
+        inside = models.LocationSnapshot.objects.get(pk=inside.pk)
+        outside = models.LocationSnapshot.objects.get(pk=outside.pk)
+        self.assertEqual(inside.city_id, 7)
+        self.assertEqual(outside.city_id, None)
+        self.assertTrue(inside.geocoded)
+        self.assertTrue(outside.geocoded)
+        self.assertEqual(LocationAnnotator.annotate(), 0)
+
+    def test_stored_city_read_first(self):
+        snapshot = self.create_snapshot(10, 10)
+        LocationAnnotator.annotate()
+        self.place_boundary.objects.get.return_value = self.city
+        self.place_boundary.DoesNotExist = type(
+            'DoesNotExist', (Exception, ), {}
+        )
+
+        with patch.object(models, 'cache') as cache:
+            cache.get.return_value = None
+            snapshot = models.LocationSnapshot.objects.get(pk=snapshot.pk)
+            self.assertEqual(snapshot.city, self.city)
+
+        self.place_boundary.objects.get.assert_called_with(pk=7)
+        self.assertEqual(self.place_boundary.get_containing.call_count, 0)
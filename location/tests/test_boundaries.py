@@ -0,0 +1,45 @@
+from django.contrib.gis.geos import Point, Polygon
+from mock import MagicMock
+
+from location import boundaries
+from location.tests.base import BaseTestCase, Boundary
+
+
+class BoundaryIndexTest(BaseTestCase):
+    def setUp(self):
+        super(BoundaryIndexTest, self).setUp()
+        if boundaries.STRtree is None:
+            self.skipTest('Shapely is not installed.')
+        self.addCleanup(boundaries.clear_boundary_indexes)
+
+        self.west = Boundary(1, Polygon.from_bbox((-123, 47, -122, 48)))
+        self.east = Boundary(2, Polygon.from_bbox((-122, 47, -121, 48)))
+        self.model = MagicMock(__name__='Boundary')
+        self.model.DoesNotExist = type('DoesNotExist', (Exception, ), {})
+        self.model.objects.all.return_value.iterator.return_value = [
+            self.west,
+            self.east,
+        ]
+        self.index = boundaries.get_boundary_index(self.model, 'geog')
+
+    def test_get_containing(self):
+        self.assertEqual(
+            self.index.get_containing(Point(-121.5, 47.5)),
+            self.east,
+        )
+        self.assertRaises(
+            self.model.DoesNotExist,
+            self.index.get_containing,
+            Point(0, 0),
+        )
+
+    def test_get_nearest_to(self):
+        nearest = self.index.get_nearest_to(Point(-120.9, 47.5))
+
+        self.assertEqual(nearest, self.east)
+        self.assertAlmostEqual(nearest.distance.km, 7.5, places=1)
+
+    def test_index_built_once(self):
+        boundaries.get_boundary_index(self.model, 'geog')
+
+        self.assertEqual(self.model.objects.all.call_count, 1)
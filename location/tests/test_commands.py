@@ -0,0 +1,135 @@
+import threading
+import time
+
+from mock import MagicMock, patch
+
+from location.management.commands import location_consumer
+from location.settings import SETTINGS
+from location.tests.base import BaseTestCase
+
+
+class PeriodicConsumer(object):
+    """ Records its runs, stopping the daemon after ``max_runs``. """
+    runs = []
+    running = 0
+    max_running = 0
+    max_runs = None
+    stopping = None
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls, max_runs=None, stopping=None):
+        cls.runs = []
+        cls.running = 0
+        cls.max_running = 0
+        cls.max_runs = max_runs
+        cls.stopping = stopping
+
+    @classmethod
+    def periodic(cls):
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(0.01)
+        with cls.lock:
+            cls.running -= 1
+            cls.runs.append(time.time())
+            if cls.max_runs is not None and len(cls.runs) >= cls.max_runs:
+                cls.stopping.set()
+
+
+class LocationConsumerDaemonTest(BaseTestCase):
+    consumer_path = 'location.tests.test_commands.PeriodicConsumer'
+
+    def setUp(self):
+        super(LocationConsumerDaemonTest, self).setUp()
+        # Consumers are run from other threads, which mustn't use the
+        # test's database connection.
+        patcher = patch.object(location_consumer, 'connection')
+        self.connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict(SETTINGS, {'transaction_scope': 'source'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.command = location_consumer.Command()
+        self.stopping = threading.Event()
+        PeriodicConsumer.reset(max_runs=3, stopping=self.stopping)
+
+    def run_periodically(self):
+        self.command.run_consumer_periodically(
+            self.consumer_path,
+            PeriodicConsumer,
+            self.stopping,
+        )
+
+    def test_interval_for_consumer(self):
+        intervals = {self.consumer_path: 5}
+        with patch.dict(SETTINGS, {
+            'periodic_consumer_intervals': intervals,
+            'periodic_interval_seconds': 300,
+        }):
+            self.assertEqual(
+                location_consumer.get_interval_for_consumer(
+                    self.consumer_path
+                ),
+                5
+            )
+            self.assertEqual(
+                location_consumer.get_interval_for_consumer('other.Consumer'),
+                300
+            )
+
+    def test_runs_at_interval_without_overlapping(self):
+        with patch.dict(
+            SETTINGS['periodic_consumer_intervals'],
+            {self.consumer_path: 0.05},
+        ):
+            self.run_periodically()
+
+        self.assertEqual(len(PeriodicConsumer.runs), 3)
+        self.assertEqual(PeriodicConsumer.max_running, 1)
+        for previous, run in zip(
+            PeriodicConsumer.runs, PeriodicConsumer.runs[1:]
+        ):
+            self.assertGreaterEqual(run - previous, 0.04)
+
+    def test_keeps_running_after_error(self):
+        errors = [ValueError('Arbitrary failure')]
+
+        def close():
+            if errors:
+                raise errors.pop()
+        self.connection.close.side_effect = close
+
+        with patch.dict(
+            SETTINGS['periodic_consumer_intervals'],
+            {self.consumer_path: 0},
+        ):
+            self.run_periodically()
+
+        self.assertEqual(len(PeriodicConsumer.runs), 3)
+        self.assertEqual(self.connection.close.call_count, 3)
+
+    def test_stops_on_sigterm(self):
+        PeriodicConsumer.reset()
+        signal = MagicMock()
+
+        with patch.object(location_consumer, 'signal', signal):
+            with patch.dict(SETTINGS, {
+                'periodic_consumers': [self.consumer_path],
+                'periodic_consumer_intervals': {self.consumer_path: 0},
+            }):
+                daemon = threading.Thread(target=self.command.run_daemon)
+                daemon.start()
+                while not PeriodicConsumer.runs:
+                    time.sleep(0.01)
+
+                handlers = dict(
+                    call[0] for call in signal.signal.call_args_list
+                )
+                handlers[signal.SIGTERM](signal.SIGTERM, None)
+                daemon.join(5)
+
+        self.assertFalse(daemon.is_alive())
+        self.assertEqual(PeriodicConsumer.running, 0)
@@ -3,15 +3,47 @@ import datetime
 import json
 
 from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test.client import RequestFactory
 from django.utils.timezone import utc
-from mock import MagicMock
+from mock import MagicMock, patch
 
-from location import models
+from location import models, utils, views
+from location.management.commands import location_consumer
+from location.settings import SETTINGS
 from location.tests.base import BaseTestCase
 from location.consumers import foursquare
 
 
 class FoursquareTest(BaseTestCase):
+    def setUp(self):
+        super(FoursquareTest, self).setUp()
+        foursquare._user_ids.clear()
+
+    def run_consumer(self):
+        location_consumer.Command().run_consumer(
+            'location.consumers.foursquare.FoursquareConsumer',
+            foursquare.FoursquareConsumer,
+        )
+
+    def get_checkin_data(self, checkin_id=None):
+        arbitrary_date = datetime.datetime(2013, 3, 2).replace(tzinfo=utc)
+        data = {
+            'type': 'checkin',
+            'venue': {
+                'location': {
+                    'lat': 60,
+                    'lng': 32,
+                },
+                'name': 'Test Location',
+            },
+            'createdAt': calendar.timegm(arbitrary_date.timetuple()),
+            'timeZone': 'UTC'
+        }
+        if checkin_id is not None:
+            data['id'] = checkin_id
+        return data
+
     def test_process_checkin(self):
         arbitrary_latitude = 60
         arbitrary_longitude = 32
@@ -29,12 +61,12 @@ class FoursquareTest(BaseTestCase):
             'timeZone': 'UTC'
         }
 
-        foursquare.FoursquareConsumer.get_user = MagicMock()
-        foursquare.FoursquareConsumer.get_user.return_value = self.user
-
         self.foursquare_consumer = foursquare.FoursquareConsumer(
             json.dumps(checkin_data)
         )
+        self.foursquare_consumer.get_user_id = MagicMock(
+            return_value=self.user.pk
+        )
         self.foursquare_consumer.process_checkin()
 
         location = models.LocationSnapshot.objects.get()
@@ -47,3 +79,213 @@ class FoursquareTest(BaseTestCase):
             arbitrary_date,
         )
         self.assertIsNotNone(location.source)
+
+    def test_checkin_view_enqueues(self):
+        request = RequestFactory().post(
+            '/foursquare/',
+            {'checkin': json.dumps(self.get_checkin_data())},
+        )
+
+        with patch.dict(SETTINGS['foursquare'], {'queue_checkins': True}):
+            response = views.foursquare_checkin(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.PendingCheckin.objects.count(), 1)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 0)
+
+    def test_checkin_view_rejects_invalid_checkin(self):
+        request = RequestFactory().post(
+            '/foursquare/',
+            {'checkin': 'not json'},
+        )
+
+        with patch.dict(SETTINGS['foursquare'], {'queue_checkins': True}):
+            response = views.foursquare_checkin(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.PendingCheckin.objects.count(), 0)
+
+    def test_periodic_processes_pending_checkins(self):
+        for _ in range(3):
+            foursquare.FoursquareConsumer.enqueue(
+                json.dumps(self.get_checkin_data())
+            )
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            with patch.dict(SETTINGS['foursquare'], {'batch_size': 2}):
+                foursquare.FoursquareConsumer.periodic()
+
+        self.assertEqual(models.PendingCheckin.objects.count(), 0)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 3)
+
+    def test_periodic_records_failed_checkins(self):
+        checkin = foursquare.FoursquareConsumer.enqueue(
+            json.dumps(self.get_checkin_data())
+        )
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            side_effect=ValueError('Arbitrary failure'),
+        ):
+            foursquare.FoursquareConsumer.periodic()
+
+        checkin = models.PendingCheckin.objects.get(pk=checkin.pk)
+        self.assertEqual(checkin.attempts, 1)
+        self.assertIn('Arbitrary failure', checkin.last_error)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 0)
+
+    def test_redelivered_checkin_stored_once(self):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            foursquare.FoursquareConsumer(checkin).process_checkin()
+            # Foursquare's retry may arrive after the cache has expired.
+            cache.clear()
+            foursquare.FoursquareConsumer(checkin).process_checkin()
+
+        self.assertEqual(models.LocationSource.objects.count(), 1)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 1)
+
+    def test_redelivered_checkin_queued_once(self):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+
+        self.assertIsNotNone(foursquare.FoursquareConsumer.enqueue(checkin))
+        self.assertIsNone(foursquare.FoursquareConsumer.enqueue(checkin))
+
+        self.assertEqual(models.PendingCheckin.objects.count(), 1)
+
+    def test_redelivered_checkin_processed_once(self):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            foursquare.FoursquareConsumer.enqueue(checkin)
+            foursquare.FoursquareConsumer.periodic()
+            foursquare.FoursquareConsumer.enqueue(checkin)
+            foursquare.FoursquareConsumer.periodic()
+
+        self.assertEqual(models.PendingCheckin.objects.count(), 0)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 1)
+
+    def test_committed_checkin_not_queued_again(self):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+        foursquare.FoursquareConsumer.enqueue(checkin)
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            self.run_consumer()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(foursquare.FoursquareConsumer.enqueue(checkin))
+        self.assertEqual(models.PendingCheckin.objects.count(), 0)
+
+    def test_rolled_back_checkin_not_seen(self):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+        foursquare.FoursquareConsumer.enqueue(checkin)
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            with self.assertRaises(ValueError):
+                with utils.after_commit():
+                    foursquare.FoursquareConsumer.periodic()
+                    raise ValueError('Arbitrary failure')
+
+        self.assertFalse(
+            foursquare.FoursquareConsumer.has_seen('arbitrary-id')
+        )
+
+    @patch.object(utils, 'in_transaction', return_value=True)
+    def test_uncommitted_checkin_not_seen(self, in_transaction):
+        checkin = json.dumps(self.get_checkin_data('arbitrary-id'))
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            return_value=self.user.pk,
+        ):
+            foursquare.FoursquareConsumer(checkin).process()
+
+        self.assertFalse(
+            foursquare.FoursquareConsumer.has_seen('arbitrary-id')
+        )
+
+    def test_failed_checkin_not_seen(self):
+        checkins = [
+            json.dumps(self.get_checkin_data(checkin_id))
+            for checkin_id in ('failed-id', 'arbitrary-id')
+        ]
+        for checkin in checkins:
+            foursquare.FoursquareConsumer.enqueue(checkin)
+        user_ids = [ValueError('Arbitrary failure'), self.user.pk]
+
+        def get_user_id(consumer):
+            user_id = user_ids.pop(0)
+            if isinstance(user_id, Exception):
+                raise user_id
+            return user_id
+
+        with patch.object(
+            foursquare.FoursquareConsumer,
+            'get_user_id',
+            get_user_id,
+        ):
+            self.run_consumer()
+
+        self.assertFalse(foursquare.FoursquareConsumer.has_seen('failed-id'))
+        self.assertTrue(
+            foursquare.FoursquareConsumer.has_seen('arbitrary-id')
+        )
+        self.assertEqual(
+            models.PendingCheckin.objects.get().checkin_id,
+            'failed-id',
+        )
+        self.assertEqual(models.LocationSnapshot.objects.count(), 1)
+
+    def get_consumer(self):
+        data = self.get_checkin_data()
+        data['user'] = {'id': 1234}
+        return foursquare.FoursquareConsumer(json.dumps(data))
+
+    @patch.object(foursquare, 'UserSocialAuth')
+    def test_user_id_cached(self, user_social_auth):
+        lookup = user_social_auth.objects.filter.return_value.values_list
+        lookup.return_value.get.return_value = self.user.pk
+
+        self.assertEqual(self.get_consumer().get_user_id(), self.user.pk)
+        self.assertEqual(self.get_consumer().get_user_id(), self.user.pk)
+        foursquare._user_ids.clear()
+        self.assertEqual(self.get_consumer().get_user_id(), self.user.pk)
+
+        self.assertEqual(lookup.return_value.get.call_count, 1)
+
+    @patch.object(foursquare, 'UserSocialAuth')
+    def test_user_id_forgotten_when_changed(self, user_social_auth):
+        lookup = user_social_auth.objects.filter.return_value.values_list
+        lookup.return_value.get.return_value = self.user.pk
+        self.get_consumer().get_user_id()
+
+        foursquare.forget_user(
+            sender=user_social_auth,
+            instance=MagicMock(provider='foursquare', uid='1234'),
+        )
+        self.get_consumer().get_user_id()
+
+        self.assertEqual(lookup.return_value.get.call_count, 2)
@@ -1,6 +1,9 @@
 import calendar
 import datetime
+import threading
+import time
 
+from django.contrib.auth.models import User
 from django.contrib.gis.geos import Point
 from django.utils.timezone import utc
 from mock import MagicMock, patch
@@ -27,6 +30,7 @@ class iCloudTest(BaseTestCase):
         )
         icloud.SETTINGS['icloud']['max_wait_seconds'] = 0.5
         icloud.SETTINGS['icloud']['request_interval_seconds'] = 0.1
+        icloud._sessions.clear()
         self.icloud_consumer = icloud.iCloudConsumer(self.user_settings)
 
     def test_get_location_data_unknown_device_id(self):
@@ -63,6 +67,49 @@ class iCloudTest(BaseTestCase):
                 arbitrary_location_data
             )
 
+    def test_get_location_data_reuses_session(self):
+        arbitrary_location_data = {
+            'somewhere': 'around',
+            'here': True
+        }
+        with patch('pyicloud.PyiCloudService.__init__') as init_mock:
+            init_mock.return_value = None
+            mock_device = MagicMock()
+            mock_device.location.return_value = arbitrary_location_data
+            pyicloud.PyiCloudService.devices = {}
+            pyicloud.PyiCloudService.devices[self.arbitrary_device_id] = (
+                mock_device
+            )
+            self.icloud_consumer.data_is_accurate = MagicMock()
+            self.icloud_consumer.data_is_accurate.return_value = True
+
+            self.icloud_consumer.get_location_data()
+            self.icloud_consumer.get_location_data()
+
+            self.assertEqual(init_mock.call_count, 1)
+
+            self.user_settings.icloud_password = 'other_password'
+            self.icloud_consumer.get_location_data()
+
+            self.assertEqual(init_mock.call_count, 2)
+
+    def test_get_location_data_forgets_failed_session(self):
+        with patch('pyicloud.PyiCloudService.__init__') as init_mock:
+            init_mock.return_value = None
+            mock_device = MagicMock()
+            mock_device.location.side_effect = ValueError()
+            pyicloud.PyiCloudService.devices = {}
+            pyicloud.PyiCloudService.devices[self.arbitrary_device_id] = (
+                mock_device
+            )
+
+            with self.assertRaises(ValueError):
+                self.icloud_consumer.get_location_data()
+            with self.assertRaises(ValueError):
+                self.icloud_consumer.get_location_data()
+
+            self.assertEqual(init_mock.call_count, 2)
+
     def test_get_location_data_inaccurate(self):
         arbitrary_location_data = {
             'somewhere': 'around',
@@ -82,6 +129,55 @@ class iCloudTest(BaseTestCase):
             with self.assertRaises(icloud.LocationUnavailableException):
                 self.icloud_consumer.get_location_data()
 
+    def test_get_location_data_past_deadline(self):
+        with patch('pyicloud.PyiCloudService.__init__') as init_mock:
+            init_mock.return_value = None
+
+            with self.assertRaises(icloud.LocationUnavailableException):
+                self.icloud_consumer.get_location_data(
+                    deadline=time.time() - 1
+                )
+
+            self.assertFalse(init_mock.called)
+
+    @patch.object(icloud.iCloudConsumer, 'update_location')
+    @patch.object(icloud.iCloudConsumer, 'get_location_data')
+    def test_periodic_polls_concurrently(
+        self, get_location_data, update_location
+    ):
+        other_user = User.objects.create(username='other_username')
+        models.LocationConsumerSettings.objects.create(
+            user=other_user,
+            icloud_enabled=True,
+            icloud_username='other_username',
+            icloud_password=self.arbitrary_password,
+            icloud_device_id=self.arbitrary_device_id,
+            icloud_timezone='UTC'
+        )
+        arbitrary_location_data = {
+            'somewhere': 'around',
+            'here': True
+        }
+        started = []
+        all_started = threading.Event()
+
+        def wait_for_all_polls(deadline=None):
+            started.append(True)
+            if len(started) == 2:
+                all_started.set()
+            all_started.wait(5)
+            if not all_started.is_set():
+                raise icloud.LocationUnavailableException()
+            return arbitrary_location_data
+        get_location_data.side_effect = wait_for_all_polls
+
+        with patch.dict(icloud.SETTINGS['icloud'], {'workers': 2}):
+            icloud.iCloudConsumer.periodic()
+
+        self.assertEqual(update_location.call_count, 2)
+        for call in update_location.call_args_list:
+            self.assertEqual(call[0][0], arbitrary_location_data)
+
     def test_data_is_accurate(self):
         accurate_data = {
             'locationFinished': True,
@@ -181,3 +277,103 @@ class iCloudTest(BaseTestCase):
             snapshot.date,
             arbitrary_time,
         )
+
+    def test_update_location_backs_off_while_stationary(self):
+        arbitrary_time = datetime.datetime(2013, 3, 2).replace(tzinfo=utc)
+        mock_location_data = {
+            'timeStamp': calendar.timegm(arbitrary_time.timetuple()) * 1000,
+            'longitude': 75,
+            'latitude': 50,
+        }
+        self.icloud_consumer.update_location(mock_location_data)
+
+        settings = models.LocationConsumerSettings.objects.get(
+            pk=self.user_settings.pk
+        )
+        self.assertEqual(
+            settings.icloud_poll_interval,
+            icloud.SETTINGS['icloud']['poll_interval_seconds'],
+        )
+        self.assertIsNotNone(settings.icloud_next_poll)
+
+        later_time = arbitrary_time + datetime.timedelta(minutes=10)
+        mock_location_data['timeStamp'] = (
+            calendar.timegm(later_time.timetuple()) * 1000
+        )
+        self.icloud_consumer.update_location(mock_location_data)
+
+        settings = models.LocationConsumerSettings.objects.get(
+            pk=self.user_settings.pk
+        )
+        self.assertEqual(
+            settings.icloud_poll_interval,
+            icloud.SETTINGS['icloud']['poll_interval_seconds'] * 2,
+        )
+
+    def test_get_poll_interval_moving_quickly(self):
+        arbitrary_time = datetime.datetime(2013, 3, 2).replace(tzinfo=utc)
+        previous = models.LocationSnapshot(
+            location=Point(-122.68, 45.52),
+            date=arbitrary_time,
+        )
+        current = models.LocationSnapshot(
+            location=Point(-122.68, 45.62),
+            date=arbitrary_time + datetime.timedelta(minutes=5),
+        )
+
+        actual_interval = self.icloud_consumer.get_poll_interval(
+            previous,
+            current,
+        )
+
+        self.assertEqual(
+            actual_interval,
+            icloud.SETTINGS['icloud']['min_poll_interval_seconds'],
+        )
+
+    def test_get_poll_interval_moving_slowly(self):
+        arbitrary_time = datetime.datetime(2013, 3, 2).replace(tzinfo=utc)
+        previous = models.LocationSnapshot(
+            location=Point(-122.68, 45.52),
+            date=arbitrary_time,
+        )
+        current = models.LocationSnapshot(
+            location=Point(-122.68, 45.53),
+            date=arbitrary_time + datetime.timedelta(minutes=30),
+        )
+        base_interval = icloud.SETTINGS['icloud']['poll_interval_seconds']
+
+        self.user_settings.icloud_poll_interval = base_interval * 4
+        self.assertEqual(
+            self.icloud_consumer.get_poll_interval(previous, current),
+            base_interval * 2,
+        )
+
+        self.user_settings.icloud_poll_interval = base_interval
+        self.assertEqual(
+            self.icloud_consumer.get_poll_interval(previous, current),
+            base_interval,
+        )
+
+    def test_get_icloud_enabled_settings_only_due(self):
+        self.user_settings.icloud_next_poll = (
+            datetime.datetime.utcnow().replace(tzinfo=utc)
+            + datetime.timedelta(minutes=5)
+        )
+        self.user_settings.save()
+
+        self.assertEqual(
+            list(icloud.iCloudConsumer.get_icloud_enabled_settings()),
+            [],
+        )
+
+        self.user_settings.icloud_next_poll = (
+            datetime.datetime.utcnow().replace(tzinfo=utc)
+            - datetime.timedelta(minutes=5)
+        )
+        self.user_settings.save()
+
+        self.assertEqual(
+            list(icloud.iCloudConsumer.get_icloud_enabled_settings()),
+            [self.user_settings],
+        )
@@ -0,0 +1,91 @@
+import datetime
+
+from django.db import connection
+from django.utils.timezone import utc
+
+from location import models
+from location.indexes import create_indexes
+from location.tests.base import BaseTestCase
+
+
+class IndexTest(BaseTestCase):
+    def setUp(self):
+        super(IndexTest, self).setUp()
+        if connection.vendor not in ('postgresql', 'sqlite', ):
+            self.skipTest(
+                'Query plans are not inspected for %s.' % connection.vendor
+            )
+        create_indexes()
+
+        self.source_type = models.LocationSourceType.objects.create(
+            name='Runmeter'
+        )
+        self.source = models.LocationSource.objects.create(
+            name='Whatnot',
+            user=self.user,
+            type=self.source_type,
+            active=True,
+            data={},
+        )
+        self.now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    def get_query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            # The test tables are far too small for an index to be worth
+            # using otherwise.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '\n'.join(
+            ' '.join(str(column) for column in row)
+            for row in cursor.fetchall()
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.get_query_plan(queryset)
+        self.assertIn(index_name, plan, plan)
+
+    def test_active_sources_of_type(self):
+        self.assertUsesIndex(
+            models.LocationSource.objects.filter(
+                type=self.source_type,
+                active=True,
+            ),
+            'location_source_type_active',
+        )
+
+    def test_recent_sources_of_user_and_type(self):
+        self.assertUsesIndex(
+            models.LocationSource.objects.filter(
+                created__gt=self.now - datetime.timedelta(days=1),
+                user=self.user,
+                type=self.source_type,
+            ),
+            'location_source_user_type_created',
+        )
+
+    def test_newest_point_of_source(self):
+        self.assertUsesIndex(
+            self.source.points.order_by('-date'),
+            'location_snapshot_source_date',
+        )
+
+    def test_runmeter_settings_by_email(self):
+        self.assertUsesIndex(
+            models.LocationConsumerSettings.objects.filter(
+                runmeter_enabled=True,
+                runmeter_email='somebody@somewhere.com',
+            ),
+            'location_settings_runmeter_email',
+        )
+
+    def test_snapshots_by_date(self):
+        self.assertUsesIndex(
+            models.LocationSnapshot.objects.filter(
+                date__gte=self.now - datetime.timedelta(days=1),
+            ),
+            'location_snapshot_date',
+        )
@@ -0,0 +1,210 @@
+import datetime
+
+from django.contrib.gis.geos import Point, Polygon
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.utils.timezone import utc
+from mock import MagicMock, patch
+
+from location import models
+from location.settings import SETTINGS
+from location.tests.base import BaseTestCase, Boundary
+
+
+class LocationDetailsTest(BaseTestCase):
+    def setUp(self):
+        super(LocationDetailsTest, self).setUp()
+        self.source_type = models.LocationSourceType.objects.create(
+            name='Arbitrary Source Type'
+        )
+        self.source = models.LocationSource.objects.create(
+            name='Arbitrary Source',
+            type=self.source_type,
+            user=self.user,
+            active=False,
+            data={},
+        )
+        self.snapshot = models.LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                10,
+                10
+            ),
+            date=datetime.datetime.utcnow().replace(tzinfo=utc)
+        )
+
+        self.place_boundary = MagicMock()
+        self.place_boundary.DoesNotExist = type(
+            'DoesNotExist', (Exception, ), {}
+        )
+        patcher = patch.object(models, 'PlaceBoundary', self.place_boundary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_city_miss_is_cached(self):
+        self.place_boundary.get_containing.side_effect = (
+            self.place_boundary.DoesNotExist
+        )
+
+        self.assertEqual(self.snapshot.city, None)
+        self.assertEqual(
+            models.LocationSnapshot.objects.get(pk=self.snapshot.pk).city,
+            None,
+        )
+
+        self.assertEqual(self.place_boundary.get_containing.call_count, 1)
+
+    def test_city_memoized_on_instance(self):
+        self.place_boundary.get_containing.return_value = 'Seattle'
+
+        with patch.object(models, 'cache') as cache:
+            cache.get.return_value = None
+            self.assertEqual(self.snapshot.city, 'Seattle')
+            self.assertEqual(self.snapshot.city, 'Seattle')
+
+        self.assertEqual(cache.get.call_count, 1)
+        self.assertEqual(self.place_boundary.get_containing.call_count, 1)
+
+    def test_prefetch_location_details(self):
+        self.place_boundary.get_containing.side_effect = (
+            self.place_boundary.DoesNotExist
+        )
+        self.place_boundary.get_nearest_to.return_value = 'Seattle'
+        self.snapshot.city
+        self.snapshot.find_nearest_city()
+
+        snapshots = list(models.LocationSnapshot.objects.all())
+        models.LocationSnapshot.prefetch_location_details(snapshots)
+
+        with patch.object(models, 'cache') as cache:
+            self.assertEqual(snapshots[0].city, None)
+            self.assertEqual(snapshots[0].find_nearest_city(), 'Seattle')
+
+        self.assertEqual(cache.get.call_count, 0)
+        self.assertEqual(self.place_boundary.get_containing.call_count, 1)
+        self.assertEqual(self.place_boundary.get_nearest_to.call_count, 1)
+
+    def get_snapshot_at(self, lng, lat):
+        return models.LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                lng,
+                lat
+            ),
+            date=datetime.datetime.utcnow().replace(tzinfo=utc)
+        )
+
+    def test_city_shared_within_cell(self):
+        self.place_boundary.get_containing.return_value = 'Seattle'
+
+        with patch.dict(SETTINGS, {'location_detail_cell_precision': 6}):
+            with patch.object(
+                models,
+                'get_geometry',
+                return_value=Polygon.from_bbox((-123, 47, -122, 48)),
+            ):
+                self.get_snapshot_at(-122.5, 47.5).city
+                nearby = self.get_snapshot_at(-122.5001, 47.5001).city
+
+        self.assertEqual(nearby, 'Seattle')
+        self.assertEqual(self.place_boundary.get_containing.call_count, 1)
+
+    def test_city_not_shared_across_boundary(self):
+        self.place_boundary.get_containing.return_value = 'Seattle'
+
+        with patch.dict(SETTINGS, {'location_detail_cell_precision': 6}):
+            with patch.object(
+                models,
+                'get_geometry',
+                return_value=Polygon.from_bbox((-123, 47, -122, 48)),
+            ):
+                self.get_snapshot_at(-122.0001, 47.5).city
+                self.get_snapshot_at(-122.0002, 47.5).city
+
+        self.assertEqual(self.place_boundary.get_containing.call_count, 2)
+
+    def test_load_location_details(self):
+        inside = Boundary(1, Polygon.from_bbox((0, 0, 20, 20)))
+        self.place_boundary.objects.filter.return_value = [inside]
+        outside = self.get_snapshot_at(30, 30)
+
+        with patch.object(
+            models, 'get_geometry_field_name', return_value='geog'
+        ):
+            with patch.object(
+                models,
+                'get_geometry',
+                side_effect=lambda boundary: boundary.geog
+            ):
+                models.LocationSnapshot.load_location_details(
+                    [self.snapshot, outside]
+                )
+
+        self.assertEqual(self.place_boundary.objects.filter.call_count, 1)
+        self.assertEqual(self.snapshot.city, inside)
+        self.assertEqual(outside.city, None)
+        self.assertEqual(self.place_boundary.get_containing.call_count, 0)
+
+
+class LocationSourceTypeCacheTest(BaseTestCase):
+    def test_source_type_cached(self):
+        source_type = models.LocationSourceType.objects.get_for_name(
+            'Arbitrary Source Type'
+        )
+        models.LocationSourceType.objects.get_for_name('Arbitrary Source Type')
+
+        with self.assertNumQueries(0):
+            cached = models.LocationSourceType.objects.get_for_name(
+                'Arbitrary Source Type'
+            )
+
+        self.assertEqual(cached, source_type)
+        self.assertEqual(models.LocationSourceType.objects.count(), 1)
+
+    def test_cache_cleared_on_save(self):
+        source_type = models.LocationSourceType.objects.create(
+            name='Arbitrary Source Type'
+        )
+        models.LocationSourceType.objects.get_for_name('Arbitrary Source Type')
+
+        source_type.name = 'Other Source Type'
+        source_type.save()
+
+        self.assertNotEqual(
+            models.LocationSourceType.objects.get_for_name(
+                'Arbitrary Source Type'
+            ),
+            source_type,
+        )
+
+    def test_cache_cleared_by_other_process(self):
+        manager = models.LocationSourceType.objects
+        manager.get_for_name('Arbitrary Source Type')
+        manager.get_for_name('Arbitrary Source Type')
+
+        # As when another process changes a source type
+        cache.set(manager.get_version_cache_key(), 'other')
+
+        with patch.dict(SETTINGS, {'source_type_check_seconds': 0}):
+            with self.assertNumQueries(1):
+                manager.get_for_name('Arbitrary Source Type')
+            with self.assertNumQueries(0):
+                manager.get_for_name('Arbitrary Source Type')
+
+    def test_source_type_created_concurrently(self):
+        source_type = models.LocationSourceType.objects.create(
+            name='Arbitrary Source Type'
+        )
+
+        # As when another process creates it after it was looked for
+        with patch.object(
+            models.LocationSourceTypeManager,
+            'get_or_create',
+            side_effect=IntegrityError(),
+        ):
+            self.assertEqual(
+                models.LocationSourceType.objects.get_for_name(
+                    'Arbitrary Source Type'
+                ),
+                source_type,
+            )
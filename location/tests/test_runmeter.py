@@ -1,19 +1,52 @@
+import BaseHTTPServer
 import datetime
+import gzip
 import json
 import os.path
+import StringIO
+import threading
 
 from django.contrib.gis.geos import Point
 from django.utils.timezone import utc
 from django_mailbox.models import Mailbox, Message
 from django_mailbox.signals import message_received
-from lxml import objectify
 from mock import MagicMock, patch
 
 from location import models
+from location.settings import SETTINGS
 from location.tests.base import BaseTestCase
+from location.consumers import runmeter
 from location.consumers.runmeter import RunmeterConsumer
 
 
+class RunmeterDocumentHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    etag = '"arbitrary-etag"'
+    document = None
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = StringIO.StringIO()
+        compressed = gzip.GzipFile(fileobj=body, mode='wb')
+        compressed.write(self.document)
+        compressed.close()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body.getvalue())))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body.getvalue())
+
+    def log_message(self, *args):
+        pass
+
+
 class RunmeterTest(BaseTestCase):
     def setUp(self):
         super(RunmeterTest, self).setUp()
@@ -35,8 +68,8 @@ class RunmeterTest(BaseTestCase):
             os.path.dirname(__file__),
             'files/sample_cycle.kml',
         )
-        with open(file_path, 'r') as incoming:
-            return objectify.fromstring(incoming.read())
+        with open(file_path, 'rb') as incoming:
+            return RunmeterConsumer._parse_document(incoming)
 
     @patch.object(RunmeterConsumer, 'get_import_url_from_message_body')
     @patch.object(RunmeterConsumer, 'get_source_from_user_and_url')
@@ -118,10 +151,35 @@ class RunmeterTest(BaseTestCase):
             expected_value = json.loads(incoming.read())
 
         self.assertEqual(
-            actual_value,
+            list(actual_value),
             expected_value,
         )
 
+    def test_get_points_since(self):
+        arbitrary_time = datetime.datetime.utcnow().replace(tzinfo=utc)
+        document = self._get_sample_document()
+        consumer = RunmeterConsumer(None)
+
+        with open(
+            os.path.join(
+                os.path.dirname(__file__),
+                'files/expected_points.json',
+            )
+        ) as incoming:
+            all_points = json.loads(incoming.read())
+        since = all_points[-5]['time']
+
+        actual_value = consumer.get_points(
+            document,
+            arbitrary_time,
+            since=since,
+        )
+
+        self.assertEqual(
+            list(actual_value),
+            all_points[-4:],
+        )
+
     def test_process_new_source(self):
         arbitrary_url = 'http://www.go.com/101'
         arbitrary_route_name = 'Something'
@@ -132,7 +190,7 @@ class RunmeterTest(BaseTestCase):
             active=True,
             data={
                 'url': arbitrary_url,
-                'known_points': {},
+                'last_point_time': None,
             }
         )
         arbitrary_document = MagicMock()
@@ -168,7 +226,8 @@ class RunmeterTest(BaseTestCase):
         consumer.get_route_name.assert_called_with(arbitrary_document)
         consumer.get_points.assert_called_with(
             arbitrary_document,
-            arbitrary_time
+            arbitrary_time,
+            since=None,
         )
 
         actual_points = models.LocationSnapshot.objects.order_by('date')
@@ -204,9 +263,7 @@ class RunmeterTest(BaseTestCase):
             active=True,
             data={
                 'url': arbitrary_url,
-                'known_points': {
-                    'alpha': 'arbitrary_value'
-                },
+                'last_point_time': 1,
             }
         )
         arbitrary_document = MagicMock()
@@ -242,7 +299,8 @@ class RunmeterTest(BaseTestCase):
         consumer.get_route_name.assert_called_with(arbitrary_document)
         consumer.get_points.assert_called_with(
             arbitrary_document,
-            arbitrary_time
+            arbitrary_time,
+            since=1,
         )
 
         actual_points = models.LocationSnapshot.objects.order_by('date')
@@ -260,6 +318,262 @@ class RunmeterTest(BaseTestCase):
             models.LocationSource.objects.get(pk=arbitrary_source.pk).active
         )
 
+    def test_process_stores_points_in_batches(self):
+        arbitrary_url = 'http://www.go.com/101'
+        arbitrary_source = models.LocationSource.objects.create(
+            name='Whatnot',
+            user=self.user,
+            type=self.source_type,
+            active=True,
+            data={
+                'url': arbitrary_url,
+                'last_point_time': None,
+            }
+        )
+        arbitrary_time = datetime.datetime.utcnow().replace(
+            tzinfo=utc
+        )
+        arbitrary_points = [
+            {'lat': -122, 'lng': 45, 'key': 'alpha', 'time': 1},
+            {'lat': -123, 'lng': 44, 'key': 'beta', 'time': 2},
+            {'lat': -124, 'lng': 43, 'key': 'gamma', 'time': 3},
+        ]
+
+        consumer = RunmeterConsumer(arbitrary_source)
+        consumer._get_document = MagicMock()
+        consumer.get_start_time = MagicMock(
+            return_value=arbitrary_time
+        )
+        consumer.get_route_name = MagicMock(
+            return_value=None
+        )
+        consumer.get_points = MagicMock(
+            return_value=arbitrary_points
+        )
+        consumer.is_active = MagicMock(
+            return_value=True
+        )
+
+        bulk_create = MagicMock(
+            wraps=models.LocationSnapshot.objects.bulk_create
+        )
+        with patch.dict(SETTINGS['runmeter'], {'batch_size': 2}):
+            with patch.object(
+                models.LocationSnapshot.objects, 'bulk_create', bulk_create
+            ):
+                consumer.process()
+
+        self.assertEqual(bulk_create.call_count, 2)
+        self.assertEqual(models.LocationSnapshot.objects.count(), 3)
+        self.assertEqual(
+            models.LocationSnapshot.objects.filter(user=self.user).count(),
+            3,
+        )
+        self.assertEqual(
+            models.LocationSource.objects.get(
+                pk=arbitrary_source.pk
+            ).data['last_point_time'],
+            3,
+        )
+
+    def test_process_registers_only_stored_batch(self):
+        arbitrary_source = models.LocationSource.objects.create(
+            name='Whatnot',
+            user=self.user,
+            type=self.source_type,
+            active=True,
+            data={
+                'url': 'http://www.go.com/101',
+                'last_point_time': None,
+            }
+        )
+        arbitrary_time = datetime.datetime.utcnow().replace(
+            tzinfo=utc
+        )
+        models.LocationSnapshot.objects.create(
+            source=arbitrary_source,
+            location=Point(-123, 44),
+            date=arbitrary_time + datetime.timedelta(seconds=2),
+        )
+        arbitrary_points = [
+            {'lat': -122, 'lng': 45, 'key': 'alpha', 'time': 1},
+            {'lat': -124, 'lng': 43, 'key': 'gamma', 'time': 3},
+        ]
+
+        consumer = RunmeterConsumer(arbitrary_source)
+        consumer._get_document = MagicMock()
+        consumer.get_start_time = MagicMock(
+            return_value=arbitrary_time
+        )
+        consumer.get_route_name = MagicMock(
+            return_value=None
+        )
+        consumer.get_points = MagicMock(
+            return_value=arbitrary_points
+        )
+        consumer.is_active = MagicMock(
+            return_value=True
+        )
+
+        with patch.object(runmeter, 'register_snapshots') as register:
+            consumer.process()
+
+        self.assertEqual(
+            [snapshot.date for snapshot in register.call_args[0][0]],
+            [
+                arbitrary_time + datetime.timedelta(seconds=1),
+                arbitrary_time + datetime.timedelta(seconds=3),
+            ]
+        )
+
+    def test_process_records_progress_with_each_batch(self):
+        arbitrary_source = models.LocationSource.objects.create(
+            name='Whatnot',
+            user=self.user,
+            type=self.source_type,
+            active=True,
+            data={
+                'url': 'http://www.go.com/101',
+                'last_point_time': None,
+            }
+        )
+        arbitrary_time = datetime.datetime.utcnow().replace(
+            tzinfo=utc
+        )
+        arbitrary_points = [
+            {'lat': -122, 'lng': 45, 'key': 'alpha', 'time': 1},
+            {'lat': -123, 'lng': 44, 'key': 'beta', 'time': 2},
+            {'lat': -124, 'lng': 43, 'key': 'gamma', 'time': 3},
+        ]
+
+        consumer = RunmeterConsumer(arbitrary_source)
+        consumer._get_document = MagicMock()
+        consumer.get_start_time = MagicMock(
+            return_value=arbitrary_time
+        )
+        consumer.get_route_name = MagicMock(
+            return_value=None
+        )
+        consumer.get_points = MagicMock(
+            return_value=arbitrary_points
+        )
+
+        original_bulk_create = models.LocationSnapshot.objects.bulk_create
+
+        def fail_after_first_batch(snapshots):
+            if bulk_create.call_count > 1:
+                raise IOError('Arbitrary failure')
+            return original_bulk_create(snapshots)
+        bulk_create = MagicMock(side_effect=fail_after_first_batch)
+
+        with patch.dict(SETTINGS['runmeter'], {'batch_size': 2}):
+            with patch.object(
+                models.LocationSnapshot.objects, 'bulk_create', bulk_create
+            ):
+                with self.assertRaises(IOError):
+                    consumer.process()
+
+        self.assertEqual(models.LocationSnapshot.objects.count(), 2)
+        self.assertEqual(
+            models.LocationSource.objects.get(
+                pk=arbitrary_source.pk
+            ).data['last_point_time'],
+            2,
+        )
+
+    def test_process_unchanged_document(self):
+        with open(
+            os.path.join(
+                os.path.dirname(__file__),
+                'files/sample_cycle.kml',
+            ),
+            'rb'
+        ) as incoming:
+            RunmeterDocumentHandler.document = incoming.read()
+        RunmeterDocumentHandler.requests = []
+        server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0),
+            RunmeterDocumentHandler
+        )
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        arbitrary_source = models.LocationSource.objects.create(
+            name='Whatnot',
+            user=self.user,
+            type=self.source_type,
+            active=True,
+            data={
+                'url': 'http://127.0.0.1:%s/route.kml' % (
+                    server.server_address[1],
+                ),
+                'last_point_time': None,
+            }
+        )
+
+        RunmeterConsumer(arbitrary_source).process()
+
+        self.assertEqual(models.LocationSnapshot.objects.count(), 197)
+        self.assertEqual(
+            arbitrary_source.data['etag'],
+            RunmeterDocumentHandler.etag,
+        )
+
+        with patch.object(RunmeterConsumer, '_parse_document') as parse:
+            RunmeterConsumer(arbitrary_source).process()
+            self.assertFalse(parse.called)
+
+        self.assertEqual(
+            RunmeterDocumentHandler.requests[-1]['if-none-match'],
+            RunmeterDocumentHandler.etag,
+        )
+        self.assertIn(
+            'gzip',
+            RunmeterDocumentHandler.requests[-1]['accept-encoding'],
+        )
+        self.assertEqual(models.LocationSnapshot.objects.count(), 197)
+
+    def test_process_active_sources(self):
+        arbitrary_urls = [
+            'http://www.go.com/101',
+            'http://www.go.com/102',
+            'http://www.go.com/103',
+        ]
+        for arbitrary_url in arbitrary_urls:
+            models.LocationSource.objects.create(
+                name='Whatnot',
+                user=self.user,
+                type=self.source_type,
+                active=True,
+                data={
+                    'url': arbitrary_url,
+                    'last_point_time': None,
+                }
+            )
+
+        def get_document(url):
+            if url == arbitrary_urls[0]:
+                raise IOError('Arbitrary failure')
+            return None
+
+        with patch.dict(SETTINGS['runmeter'], {'workers': 3}):
+            with patch.object(
+                RunmeterConsumer, '_get_document', side_effect=get_document
+            ) as _get_document:
+                with patch.object(RunmeterConsumer, 'update') as update:
+                    RunmeterConsumer.process_active_sources()
+
+        self.assertEqual(
+            sorted(call[0][0] for call in _get_document.call_args_list),
+            arbitrary_urls,
+        )
+        self.assertEqual(update.call_count, 2)
+        for call in update.call_args_list:
+            self.assertIsNone(call[0][0])
+
     def test_get_source_from_user_and_url_new(self):
         arbitrary_url = 'http://www.go.com/100'
 
@@ -272,7 +586,7 @@ class RunmeterTest(BaseTestCase):
             'type': self.source_type,
             'data': {
                 'url': arbitrary_url,
-                'known_points': {},
+                'last_point_time': None,
             },
             'active': True
         }
@@ -289,7 +603,7 @@ class RunmeterTest(BaseTestCase):
             type=self.source_type,
             data={
                 'url': arbitrary_url,
-                'known_points': {},
+                'last_point_time': None,
             }
         )
 
@@ -312,7 +626,7 @@ class RunmeterTest(BaseTestCase):
             type=self.source_type,
             data={
                 'url': arbitrary_url,
-                'known_points': {},
+                'last_point_time': None,
             },
         )
         arbitrary_source.created = datetime.datetime(1970, 1, 1).replace(
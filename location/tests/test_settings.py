@@ -0,0 +1,33 @@
+from location.settings import DEFAULT_SETTINGS, merge_settings
+from location.tests.base import BaseTestCase
+
+
+class SettingsTest(BaseTestCase):
+    def test_section_partially_overridden(self):
+        merged = merge_settings(
+            DEFAULT_SETTINGS,
+            {
+                'foursquare': {
+                    'queue_checkins': True,
+                },
+            }
+        )
+
+        self.assertTrue(merged['foursquare']['queue_checkins'])
+        self.assertEqual(
+            merged['foursquare']['batch_size'],
+            DEFAULT_SETTINGS['foursquare']['batch_size'],
+        )
+        self.assertFalse(DEFAULT_SETTINGS['foursquare']['queue_checkins'])
+
+    def test_setting_overridden(self):
+        merged = merge_settings(
+            DEFAULT_SETTINGS,
+            {
+                'periodic_consumers': [],
+                'cache_prefix': 'OTHER',
+            }
+        )
+
+        self.assertEqual(merged['periodic_consumers'], [])
+        self.assertEqual(merged['cache_prefix'], 'OTHER')
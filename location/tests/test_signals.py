@@ -3,13 +3,23 @@ import datetime
 from django.contrib.gis.geos import Point
 from django.dispatch import receiver
 from django.utils.timezone import utc
+from mock import patch
 
 from location.models import (
+    CurrentLocation,
     LocationSnapshot,
     LocationSource,
     LocationSourceType,
+    SignalOutboxEntry,
+)
+from location.settings import SETTINGS
+from location.signals import (
+    location_updated,
+    locations_ingested,
+    OutboxDispatcher,
+    register_snapshots,
+    watch_location,
 )
-from location.signals import location_updated, watch_location
 from location.tests.base import BaseTestCase
 
 
@@ -58,6 +68,30 @@ class SignalTest(BaseTestCase):
             len(self.signal_receipts) == 1
         )
 
+    def test_watch_location_by_user_id(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            self.signal_receipts.append({
+                'args': args,
+                'kwargs': kwargs,
+            })
+
+        with watch_location(self.user.pk):
+            LocationSnapshot.objects.create(
+                source=self.source,
+                location=Point(
+                    10,
+                    11
+                ),
+                date=datetime.datetime.utcnow().replace(tzinfo=utc)
+            )
+
+        self.assertEqual(len(self.signal_receipts), 1)
+        self.assertEqual(
+            self.signal_receipts[0]['kwargs']['user'],
+            self.user,
+        )
+
     def test_watch_location_unchanged(self):
         @receiver(location_updated, dispatch_uid='signal_test_uid')
         def process_incoming_location(*args, **kwargs):
@@ -97,3 +131,251 @@ class SignalTest(BaseTestCase):
         self.assertTrue(
             len(self.signal_receipts) == 0
         )
+
+    def test_watch_location_uses_saved_snapshots(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            self.signal_receipts.append(kwargs)
+
+        watcher = watch_location(self.user)
+        with patch.object(
+            watcher,
+            '_get_current_location',
+            wraps=watcher._get_current_location,
+        ) as get_current_location:
+            with watcher:
+                snapshot = LocationSnapshot.objects.create(
+                    source=self.source,
+                    location=Point(
+                        10,
+                        11
+                    ),
+                    date=self.snapshot.date + datetime.timedelta(minutes=5)
+                )
+
+        self.assertEqual(get_current_location.call_count, 1)
+        self.assertEqual(len(self.signal_receipts), 1)
+        self.assertEqual(self.signal_receipts[0]['from_'], self.snapshot)
+        self.assertEqual(self.signal_receipts[0]['to'], snapshot)
+
+    def test_watch_location_registered_snapshots(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            self.signal_receipts.append(kwargs)
+
+        date = self.snapshot.date + datetime.timedelta(minutes=5)
+        with watch_location(self.user):
+            LocationSnapshot.objects.bulk_create([
+                LocationSnapshot(
+                    source=self.source,
+                    location=Point(
+                        10,
+                        11
+                    ),
+                    date=date,
+                ),
+            ])
+            register_snapshots(
+                LocationSnapshot.objects.filter(date=date)
+            )
+
+        self.assertEqual(len(self.signal_receipts), 1)
+        self.assertEqual(self.signal_receipts[0]['to'].date, date)
+
+    def test_locations_ingested_sent_once(self):
+        @receiver(locations_ingested, dispatch_uid='signal_test_uid')
+        def process_ingested_locations(*args, **kwargs):
+            self.signal_receipts.append(kwargs)
+
+        dates = [
+            self.snapshot.date + datetime.timedelta(minutes=offset)
+            for offset in (5, 10)
+        ]
+        with watch_location(self.user):
+            for date in reversed(dates):
+                LocationSnapshot.objects.create(
+                    source=self.source,
+                    location=Point(
+                        10,
+                        11
+                    ),
+                    date=date,
+                )
+
+        self.assertEqual(len(self.signal_receipts), 1)
+        self.assertEqual(
+            [s.date for s in self.signal_receipts[0]['snapshots']],
+            dates,
+        )
+        self.assertEqual(self.signal_receipts[0]['from_'], self.snapshot)
+        self.assertEqual(
+            self.signal_receipts[0]['to'].date,
+            dates[-1],
+        )
+
+    def test_locations_ingested_not_sent_without_snapshots(self):
+        @receiver(locations_ingested, dispatch_uid='signal_test_uid')
+        def process_ingested_locations(*args, **kwargs):
+            self.signal_receipts.append(kwargs)
+
+        with watch_location(self.user):
+            pass
+
+        self.assertEqual(len(self.signal_receipts), 0)
+
+    def test_snapshot_user_copied_from_source(self):
+        self.assertEqual(self.snapshot.user, self.user)
+
+    def test_current_location_follows_newest_snapshot(self):
+        newer = LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                10,
+                11
+            ),
+            date=self.snapshot.date + datetime.timedelta(minutes=5)
+        )
+        LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                10,
+                12
+            ),
+            date=self.snapshot.date - datetime.timedelta(minutes=5)
+        )
+
+        self.assertEqual(
+            CurrentLocation.objects.get(user=self.user).snapshot,
+            newer,
+        )
+
+    def test_current_location_refreshed_on_delete(self):
+        newer = LocationSnapshot.objects.create(
+            source=self.source,
+            location=Point(
+                10,
+                11
+            ),
+            date=self.snapshot.date + datetime.timedelta(minutes=5)
+        )
+
+        newer.delete()
+
+        self.assertEqual(
+            CurrentLocation.objects.get(user=self.user).snapshot,
+            self.snapshot,
+        )
+
+    def test_outbox_defers_signals(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            self.signal_receipts.append(kwargs)
+
+        with patch.dict(SETTINGS, {'signal_dispatch': 'outbox'}):
+            with watch_location(self.user):
+                snapshot = LocationSnapshot.objects.create(
+                    source=self.source,
+                    location=Point(
+                        10,
+                        11
+                    ),
+                    date=self.snapshot.date + datetime.timedelta(minutes=5)
+                )
+
+        self.assertEqual(len(self.signal_receipts), 0)
+        self.assertEqual(
+            sorted(
+                SignalOutboxEntry.objects.values_list('signal', flat=True)
+            ),
+            ['location_changed', 'location_updated', 'locations_ingested'],
+        )
+
+        self.assertEqual(OutboxDispatcher.dispatch(), 3)
+
+        self.assertEqual(len(self.signal_receipts), 1)
+        self.assertEqual(self.signal_receipts[0]['user'], self.user)
+        self.assertEqual(self.signal_receipts[0]['from_'], self.snapshot)
+        self.assertEqual(self.signal_receipts[0]['to'], snapshot)
+        self.assertEqual(SignalOutboxEntry.objects.count(), 0)
+
+    def test_outbox_retries_failed_signals(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            raise ValueError('Arbitrary failure')
+
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        entry = SignalOutboxEntry.objects.create(
+            signal='location_updated',
+            user=self.user,
+            data={
+                'from_': None,
+                'to': self.snapshot.pk,
+            },
+            next_attempt=now,
+        )
+
+        self.assertEqual(OutboxDispatcher.dispatch(), 0)
+
+        entry = SignalOutboxEntry.objects.get(pk=entry.pk)
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('Arbitrary failure', entry.last_error)
+        self.assertTrue(
+            entry.next_attempt >= now + datetime.timedelta(
+                seconds=SETTINGS['outbox']['retry_delay_seconds']
+            )
+        )
+
+    def test_outbox_discards_signals_after_max_attempts(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(*args, **kwargs):
+            raise ValueError('Arbitrary failure')
+
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        SignalOutboxEntry.objects.create(
+            signal='location_updated',
+            user=self.user,
+            data={
+                'from_': None,
+                'to': self.snapshot.pk,
+            },
+            attempts=SETTINGS['outbox']['max_attempts'] - 1,
+            next_attempt=now,
+        )
+        # As though its dispatcher died during its last attempt
+        SignalOutboxEntry.objects.create(
+            signal='location_updated',
+            user=self.user,
+            data={
+                'from_': None,
+                'to': self.snapshot.pk,
+            },
+            attempts=SETTINGS['outbox']['max_attempts'],
+            next_attempt=now,
+        )
+
+        self.assertEqual(OutboxDispatcher.dispatch(), 0)
+
+        self.assertEqual(SignalOutboxEntry.objects.count(), 0)
+
+    def test_dispatch_modes_send_from_same_sender(self):
+        @receiver(location_updated, dispatch_uid='signal_test_uid')
+        def process_incoming_location(sender, **kwargs):
+            self.signal_receipts.append(sender)
+
+        for dispatch in ('sync', 'outbox', ):
+            with patch.dict(SETTINGS, {'signal_dispatch': dispatch}):
+                with watch_location(self.user):
+                    LocationSnapshot.objects.create(
+                        source=self.source,
+                        location=Point(
+                            10,
+                            11
+                        ),
+                        date=datetime.datetime.utcnow().replace(tzinfo=utc)
+                    )
+        OutboxDispatcher.dispatch()
+
+        self.assertEqual(
+            self.signal_receipts,
+            [watch_location, watch_location],
+        )
@@ -0,0 +1,64 @@
+from django.db import connection
+from django.test import TransactionTestCase
+from mock import patch
+
+from location.models import LocationSourceType
+from location.settings import SETTINGS
+from location.utils import transaction_scope
+
+
+class TransactionScopeTest(TransactionTestCase):
+    def store_source_type(self, name, fail=False):
+        try:
+            with transaction_scope('source'):
+                LocationSourceType.objects.create(name=name)
+                if fail:
+                    raise ValueError('Arbitrary failure')
+        except ValueError:
+            pass
+
+    def get_stored_names(self):
+        return set(
+            LocationSourceType.objects.values_list('name', flat=True)
+        )
+
+    def test_failed_scope_rolled_back(self):
+        for scope in ('source', 'batch', ):
+            with patch.dict(SETTINGS, {'transaction_scope': scope}):
+                try:
+                    with transaction_scope(scope):
+                        LocationSourceType.objects.create(name=scope)
+                        raise ValueError('Arbitrary failure')
+                except ValueError:
+                    pass
+
+        self.assertEqual(self.get_stored_names(), set())
+
+    def test_writes_outside_scope_committed(self):
+        with patch.dict(SETTINGS, {'transaction_scope': 'batch'}):
+            self.store_source_type('Stored', fail=True)
+
+        self.assertEqual(self.get_stored_names(), set(['Stored']))
+
+    def test_failure_in_consumer_scope_rolled_back_alone(self):
+        if not connection.features.uses_savepoints:
+            self.skipTest('%s has no savepoints.' % connection.vendor)
+
+        with patch.dict(SETTINGS, {'transaction_scope': 'consumer'}):
+            with transaction_scope('consumer'):
+                self.store_source_type('First')
+                self.store_source_type('Failed', fail=True)
+                self.store_source_type('Last')
+
+        self.assertEqual(self.get_stored_names(), set(['First', 'Last']))
+
+    def test_failed_consumer_scope_rolled_back(self):
+        with patch.dict(SETTINGS, {'transaction_scope': 'consumer'}):
+            try:
+                with transaction_scope('consumer'):
+                    self.store_source_type('First')
+                    raise ValueError('Arbitrary failure')
+            except ValueError:
+                pass
+
+        self.assertEqual(self.get_stored_names(), set())
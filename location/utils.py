@@ -0,0 +1,268 @@
+from contextlib import contextmanager
+import itertools
+import logging
+import math
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+import time
+
+from django.db import connection, transaction
+
+from location.settings import SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+
+EARTH_RADIUS_METERS = 6371009
+
+
+def get_distance_meters(point_a, point_b):
+    """ Returns the great-circle distance between two longitude/latitude
+    points.
+
+    """
+    lng_a, lat_a = map(math.radians, point_a.coords[:2])
+    lng_b, lat_b = map(math.radians, point_b.coords[:2])
+    a = (
+        math.sin((lat_b - lat_a) / 2) ** 2
+        + math.cos(lat_a) * math.cos(lat_b)
+        * math.sin((lng_b - lng_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(math.sqrt(a), 1))
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def get_geohash_cell(point, precision):
+    """ Returns the geohash of the cell containing a longitude/latitude
+    point, along with the cell's ``(min_lng, min_lat, max_lng, max_lat)``
+    bounding box.
+
+    """
+    lng, lat = point.coords[:2]
+    lng_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+    characters = []
+    bit = 0
+    value = 0
+    even = True
+    while len(characters) < precision:
+        # Bits alternate between longitude and latitude, each halving the
+        # remaining range.
+        if even:
+            coordinate, bounds = lng, lng_range
+        else:
+            coordinate, bounds = lat, lat_range
+        middle = (bounds[0] + bounds[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            bounds[0] = middle
+        else:
+            value = value * 2
+            bounds[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            characters.append(GEOHASH_ALPHABET[value])
+            bit = 0
+            value = 0
+    return ''.join(characters), (
+        lng_range[0], lat_range[0], lng_range[1], lat_range[1],
+    )
+
+
+def in_transaction():
+    """ Returns ``True`` if writes made now won't be committed until an
+    enclosing transaction is.
+
+    """
+    if hasattr(transaction, 'atomic'):
+        return connection.in_atomic_block
+    return transaction.is_managed()
+
+
+@contextmanager
+def savepoint():
+    """ Rolls back the enclosed block, and only the enclosed block, if it
+    raises an exception.
+
+    """
+    if hasattr(transaction, 'atomic'):
+        with transaction.atomic():
+            yield
+        return
+    sid = transaction.savepoint()
+    try:
+        yield
+    except:
+        transaction.savepoint_rollback(sid)
+        raise
+    transaction.savepoint_commit(sid)
+
+
+@contextmanager
+def transaction_scope(*scopes):
+    """ Commits the enclosed block as a single transaction if the configured
+    ``transaction_scope`` setting is one of ``scopes``.
+
+    Otherwise, if the block is within a larger transaction, it is run in a
+    savepoint, so that a failure within the block doesn't prevent the
+    rest of the transaction from being committed.
+
+    """
+    if SETTINGS['transaction_scope'] in scopes:
+        if hasattr(transaction, 'atomic'):
+            with transaction.atomic():
+                yield
+        else:
+            with transaction.commit_on_success():
+                yield
+    elif in_transaction():
+        with savepoint():
+            yield
+    else:
+        yield
+
+
+_deferred = threading.local()
+
+
+def on_commit(function):
+    """ Calls ``function`` once the writes made so far have been committed.
+
+    Within ``after_commit``, the call is deferred until the block exits.
+    Otherwise, it's made at once, unless within a transaction whose fate
+    isn't known, in which case ``function`` is never called.
+
+    """
+    callbacks = getattr(_deferred, 'callbacks', None)
+    if callbacks is not None:
+        callbacks.append(function)
+    elif not in_transaction():
+        function()
+
+
+@contextmanager
+def after_commit():
+    """ Defers the ``on_commit`` calls made within the block, which commits
+    its own writes, until it exits; they're discarded if it raises an
+    exception.
+
+    """
+    if getattr(_deferred, 'callbacks', None) is not None:
+        yield
+        return
+    _deferred.callbacks = []
+    try:
+        yield
+        callbacks = _deferred.callbacks
+    finally:
+        _deferred.callbacks = None
+    for callback in callbacks:
+        callback()
+
+
+class BoundedCache(object):
+    """ A thread-safe, in-process cache holding at most ``max_size`` entries.
+
+    Entries older than ``ttl`` seconds are discarded when read, and the
+    least-recently-used entry is evicted when the cache is full.
+
+    """
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, stored, _ = entry
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                del self._entries[key]
+                return default
+            entry[2] = next(self._counter)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = [value, time.time(), next(self._counter)]
+            while len(self._entries) > self.max_size:
+                least_recent = min(
+                    self._entries,
+                    key=lambda entry_key: self._entries[entry_key][2]
+                )
+                del self._entries[least_recent]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _capture_result(function):
+    def wrapped(item):
+        try:
+            return item, function(item), None
+        except Exception:
+            return item, None, sys.exc_info()
+    return wrapped
+
+
+def threaded_map(function, items, workers, deadline=None):
+    """ Calls ``function`` for each of ``items`` using a pool of threads.
+
+    Yields ``(item, result, exc_info)`` tuples in the order in which the
+    calls finish; ``exc_info`` is ``None`` unless the call raised an
+    exception.  Consumers are expected to do their database work on the
+    calling thread using the yielded results.
+
+    If ``deadline`` (a ``time.time()`` value) passes before every call has
+    finished, the remaining calls are abandoned.
+
+    """
+    items = list(items)
+    function = _capture_result(function)
+
+    if workers <= 1 or len(items) <= 1:
+        for finished, item in enumerate(items):
+            if deadline is not None and time.time() > deadline:
+                logger.warning(
+                    'Deadline reached; skipping %s remaining item(s).',
+                    len(items) - finished,
+                )
+                return
+            yield function(item)
+        return
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        results = pool.imap_unordered(function, items)
+        for finished in range(len(items)):
+            if deadline is None:
+                yield results.next()
+                continue
+            try:
+                yield results.next(max(deadline - time.time(), 0))
+            except TimeoutError:
+                logger.warning(
+                    'Deadline reached; abandoning %s remaining item(s).',
+                    len(items) - finished,
+                )
+                return
+    finally:
+        pool.terminate()
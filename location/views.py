@@ -1,13 +1,20 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 
 from location.consumers.foursquare import FoursquareConsumer
+from location.settings import SETTINGS
 
 
 @csrf_exempt
 def foursquare_checkin(request):
-    consumer = FoursquareConsumer(
-        request.POST.get('checkin', None)
-    )
-    consumer.process_checkin()
+    checkin = request.POST.get('checkin', None)
+    if SETTINGS['foursquare']['queue_checkins']:
+        try:
+            FoursquareConsumer.enqueue(checkin)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest("Invalid check-in")
+        return HttpResponse("OK")
+
+    consumer = FoursquareConsumer(checkin)
+    consumer.process()
     return HttpResponse("OK")
@@ -25,6 +25,9 @@ setup(
             'django-neighborhoods',
             'django-census-places',
         ],
+        'boundaryindex': [
+            'Shapely>=1.7',
+        ],
     },
     tests_require=[
         'mock>=1.0.1',